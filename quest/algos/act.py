@@ -31,10 +31,10 @@ class ACT(ChunkPolicy):
         total_kld, dim_wise_kld, mean_kld = kl_divergence(latent[0], latent[1])
         loss = l1_loss + total_kld[0]*self.kl_weight
         info = {
-            'l1_loss': l1_loss.item(),
-            'total_kld': total_kld[0].item(),
-            'mean_kld': mean_kld.item(),
-            'total_loss': loss.item(),
+            'l1_loss': l1_loss.detach(),
+            'total_kld': total_kld[0].detach(),
+            'mean_kld': mean_kld.detach(),
+            'total_loss': loss.detach(),
         }
         return loss, info
     
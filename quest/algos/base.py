@@ -1,9 +1,10 @@
 import torch
 import torch.nn as nn
 from collections import deque
+from concurrent import futures
 # from quest.modules.v1 import *
 import quest.utils.tensor_utils as TensorUtils
-from quest.utils.utils import map_tensor_to_device
+from quest.utils.utils import map_tensor_to_device, get_device_type
 import quest.utils.obs_utils as ObsUtils
 import einops
 
@@ -26,6 +27,8 @@ class Policy(nn.Module, ABC):
                  shape_meta,
                  device,
                  use_vision_tokens,
+                 reuse_input_buffers=True,
+                 pin_input_buffers=False,
                  ):
         super().__init__()
 
@@ -36,6 +39,10 @@ class Policy(nn.Module, ABC):
         self.scheduler_factory = scheduler_factory
         self.device = device
         self.use_vision_tokens = use_vision_tokens
+        self.reuse_input_buffers = reuse_input_buffers
+        self.pin_input_buffers = pin_input_buffers
+        # persistent inference inputs, see get_input_buffer
+        self.input_buffers = {}
         total_obs_channels = 0
 
         self.image_encoder_factory = image_encoder_factory
@@ -106,6 +113,16 @@ class Policy(nn.Module, ABC):
     def compute_loss(self, data):
         raise NotImplementedError('Implement in subclass')
 
+    def compile_hot_paths(self, **compile_kwargs):
+        """
+        Replace compute_loss and sample_actions of this instance with torch.compile'd versions.
+        The methods keep their signature, so the training loop and env runners don't change.
+        sample_actions still returns numpy arrays, the device to host copy at its end is left
+        out of the compiled graph. @compile_kwargs are passed to torch.compile.
+        """
+        self.compute_loss = torch.compile(self.compute_loss, **compile_kwargs)
+        self.sample_actions = torch.compile(self.sample_actions, **compile_kwargs)
+
     def get_optimizers(self):
         decay, no_decay = TensorUtils.separate_no_decay(self)
         optimizers = [
@@ -120,15 +137,31 @@ class Policy(nn.Module, ABC):
         else:
             return [self.scheduler_factory(optimizer=optimizer) for optimizer in optimizers]
     
+    @torch.compiler.disable
+    def augment(self, data):
+        # augmentations draw their random parameters on the host, which would split the graph
+        # of a compiled compute_loss in many places, so they always run eagerly
+        return self.aug(data)
+
     def preprocess_input(self, data, train_mode=True):
         if train_mode and self.use_augmentation:
-            data = self.aug(data)
+            data = self.augment(data)
         for key in self.image_encoders:
             for obs_key in ('obs', 'next_obs'):
                 if obs_key in data:
-                    x = TensorUtils.to_float(data[obs_key][key])
-                    x = x / 255.
-                    x = torch.clip(x, 0, 1)
+                    x = data[obs_key][key]
+                    if x.dtype == torch.uint8 and key in data.get(f"{obs_key}_buffers", {}):
+                        # normalize in place in the persistent buffer from stage_batch. A single
+                        # torch.div(x, 255., out=out) is slower on cpu, mixed dtype kernels are
+                        x = data[f"{obs_key}_buffers"][key].copy_(x).div_(255.)
+                    elif x.dtype == torch.uint8:
+                        # images arrive as uint8 so that only a quarter of the bytes are
+                        # collated and copied to the device, and are always within [0, 255]
+                        x = x.to(torch.float32).div_(255.)
+                    else:
+                        x = TensorUtils.to_float(x)
+                        x = x / 255.
+                        x = torch.clip(x, 0, 1)
                     data[obs_key][key] = x
         return data
 
@@ -177,19 +210,104 @@ class Policy(nn.Module, ABC):
         else:
             return self.task_encoder(data["task_id"])
     
-    def get_action(self, obs, task_id, task_emb=None):
-        self.eval()
+    def get_input_buffer(self, name, shape, dtype, device, pin_memory=False, stride=None):
+        """
+        Returns the persistent tensor @name used to stage inference inputs, which is only
+        reallocated when its shape, dtype or device change, e.g. with the number of envs.
+        The buffer is contiguous unless @stride is given.
+        """
+        key = (tuple(shape), stride and tuple(stride), dtype, str(device), pin_memory)
+        if name not in self.input_buffers or self.input_buffers[name][0] != key:
+            if stride is None:
+                buffer = torch.empty(shape, dtype=dtype, device=device, pin_memory=pin_memory)
+            else:
+                buffer = torch.empty_strided(shape, stride, dtype=dtype, device=device, pin_memory=pin_memory)
+            self.input_buffers[name] = (key, buffer)
+        return self.input_buffers[name][1]
+
+    def stage_input(self, name, value, dtype):
+        """
+        Copy @value into the persistent host buffer @name, casting it to @dtype and making it
+        contiguous in the same copy, and from there into a persistent buffer on the policy's
+        device. The host buffer is pinned if pin_input_buffers, so that the device copy is
+        asynchronous.
+        """
+        if get_device_type(self.device) == "cpu":
+            return self.get_input_buffer(name, value.shape, dtype, "cpu").copy_(value)
+        pin_memory = self.pin_input_buffers
+        host = self.get_input_buffer(f"{name}/host", value.shape, dtype, "cpu", pin_memory=pin_memory)
+        host.copy_(value)
+        device = self.get_input_buffer(name, value.shape, dtype, self.device)
+        return device.copy_(host, non_blocking=pin_memory)
+
+    def prepare_batch(self, obs, task_id, task_emb=None):
+        """
+        Convert the numpy observations of the envs, with shape (B, T, ...) and (B, T, H, W, C)
+        images, to a batch of tensors on the policy's device as expected by sample_actions.
+        @task_id is either an int, which is broadcast to the batch size of the observations,
+        or one task id per env.
+
+        If reuse_input_buffers, the inputs are written into persistent buffers through views
+        of the observations (see stage_input), so that inference doesn't allocate inputs, and
+        the batch also holds the buffers that preprocess_input normalizes images into under
+        "obs_buffers". They are allocated here, as a compiled sample_actions would have to
+        stop tracing for every image to look them up. The returned batch is only valid until
+        the next call.
+        """
+        if self.reuse_input_buffers:
+            return self.stage_batch(obs, task_id, task_emb)
+        batch_obs = {}
         for key, value in obs.items():
             if key in self.image_encoders:
                 value = ObsUtils.process_frame(value, channel_dim=3)
-            obs[key] = torch.tensor(value)
+            elif key in self.lowdim_encoders:
+                value = TensorUtils.to_float(value) # from double to float
+            batch_obs[key] = torch.tensor(value)
         batch = {}
-        batch["obs"] = obs
+        batch["obs"] = batch_obs
         if task_emb is not None:
             batch["task_emb"] = task_emb
         else:
-            batch["task_id"] = torch.tensor([task_id], dtype=torch.long)
-        batch = map_tensor_to_device(batch, self.device)
+            batch_size = len(next(iter(batch_obs.values()))) if len(batch_obs) > 0 else 1
+            batch["task_id"] = torch.as_tensor(task_id, dtype=torch.long).expand(batch_size).clone()
+        return map_tensor_to_device(batch, self.device)
+
+    def stage_batch(self, obs, task_id, task_emb=None):
+        batch_obs, obs_buffers = {}, {}
+        for key, value in obs.items():
+            value = torch.as_tensor(value)
+            if key in self.image_encoders:
+                # images are staged as they are and then permuted, so that the copies are
+                # contiguous and the encoders get the same channels last strides as before
+                value = self.stage_input(f"obs/{key}", value, value.dtype)
+                batch_obs[key] = ObsUtils.process_frame(value, channel_dim=3)
+                if value.dtype == torch.uint8:
+                    x = batch_obs[key]
+                    obs_buffers[key] = self.get_input_buffer(
+                        f"obs/{key}/normalized", x.shape, torch.float32, x.device, stride=x.stride())
+            elif key in self.lowdim_encoders:
+                batch_obs[key] = self.stage_input(f"obs/{key}", value, torch.float32) # from double to float
+            else:
+                batch_obs[key] = self.stage_input(f"obs/{key}", value, value.dtype)
+        batch = {}
+        batch["obs"] = batch_obs
+        batch["obs_buffers"] = obs_buffers
+        if task_emb is not None:
+            task_emb = torch.as_tensor(task_emb)
+            batch["task_emb"] = self.stage_input("task_emb", task_emb, task_emb.dtype)
+        else:
+            batch_size = len(next(iter(batch_obs.values()))) if len(batch_obs) > 0 else 1
+            task_ids = self.get_input_buffer("task_id/ids", (batch_size,), torch.long, "cpu")
+            if isinstance(task_id, int):
+                task_ids.fill_(task_id)
+            else:
+                task_ids.copy_(torch.as_tensor(task_id))
+            batch["task_id"] = self.stage_input("task_id", task_ids, torch.long)
+        return batch
+
+    def get_action(self, obs, task_id, task_emb=None):
+        self.eval()
+        batch = self.prepare_batch(obs, task_id, task_emb)
         with torch.no_grad():
             action = self.sample_actions(batch)
         return action
@@ -204,43 +322,85 @@ class Policy(nn.Module, ABC):
 
 class ChunkPolicy(Policy):
     '''
-    Super class for policies which predict chunks of actions
+    Super class for policies which predict chunks of actions.
+
+    With prefetch_distance > 0, the next chunk is predicted in a background thread from the
+    observation of the step at which prefetch_distance actions are left in the queue, so that
+    the prediction overlaps with executing them and with stepping the env. The first actions
+    of a prefetched chunk are meant for the steps that the remaining actions of the previous
+    chunk are executed in, and are dropped if drop_stale_actions. Otherwise the whole chunk is
+    executed prefetch_distance steps late. Dropping them leaves action_horizon - prefetch_distance
+    actions of every prefetched chunk, which must be more than prefetch_distance so that the
+    next chunk is requested at the same point of every chunk.
     '''
     def __init__(self, 
                  action_horizon,
+                 prefetch_distance=0,
+                 drop_stale_actions=True,
                  **kwargs):
         super().__init__(**kwargs)
+        assert 0 <= prefetch_distance < action_horizon, "prefetch_distance must be smaller than action_horizon"
+        assert not drop_stale_actions or 2 * prefetch_distance < action_horizon, \
+            "prefetch_distance must be smaller than half of action_horizon when dropping stale actions"
 
         self.action_horizon = action_horizon
+        self.prefetch_distance = prefetch_distance
+        self.drop_stale_actions = drop_stale_actions
         self.action_queue = None
+        self.prefetch_executor = None
+        # future of the chunk being prefetched and the number of actions left when it was requested
+        self.next_chunk = None
 
 
     def reset(self):
+        self.close()
         self.action_queue = deque(maxlen=self.action_horizon)
+
+    def close(self):
+        """
+        Waits for the chunk being prefetched and stops the prefetch thread, which is started
+        again by the next prefetch.
+        """
+        if self.prefetch_executor is not None:
+            # the prediction may already be running, wait for it rather than cancel it
+            self.prefetch_executor.shutdown(wait=True)
+            self.prefetch_executor = None
+        self.next_chunk = None
     
     def get_action(self, obs, task_id, task_emb=None):
         assert self.action_queue is not None, "you need to call policy.reset() before getting actions"
 
         self.eval()
+        if self.prefetch_distance > 0:
+            return self.get_action_prefetched(obs, task_id, task_emb)
         if len(self.action_queue) == 0:
-            for key, value in obs.items():
-                if key in self.image_encoders:
-                    value = ObsUtils.process_frame(value, channel_dim=3)
-                elif key in self.lowdim_encoders:
-                    value = TensorUtils.to_float(value) # from double to float
-                obs[key] = torch.tensor(value)
-            batch = {}
-            batch["obs"] = obs
-            if task_emb is not None:
-                batch["task_emb"] = task_emb
-            else:
-                batch["task_id"] = torch.tensor([task_id], dtype=torch.long)
-            batch = map_tensor_to_device(batch, self.device)
+            batch = self.prepare_batch(obs, task_id, task_emb)
             with torch.no_grad():
                 actions = self.sample_actions(batch)
                 self.action_queue.extend(actions[:self.action_horizon])
         action = self.action_queue.popleft()
         return action
+
+    def get_action_prefetched(self, obs, task_id, task_emb=None):
+        if self.next_chunk is None and len(self.action_queue) <= self.prefetch_distance:
+            # the batch is converted right away, so the env can reuse its observation buffers
+            batch = self.prepare_batch(obs, task_id, task_emb)
+            if self.prefetch_executor is None:
+                self.prefetch_executor = futures.ThreadPoolExecutor(max_workers=1)
+            future = self.prefetch_executor.submit(self.predict_chunk, batch)
+            self.next_chunk = (future, len(self.action_queue))
+        if len(self.action_queue) == 0:
+            future, n_left = self.next_chunk
+            self.next_chunk = None
+            actions = future.result()
+            start = n_left if self.drop_stale_actions else 0
+            self.action_queue.extend(actions[start:self.action_horizon])
+        return self.action_queue.popleft()
+
+    def predict_chunk(self, batch):
+        # grad mode is thread local, so it is set in the prefetch thread
+        with torch.no_grad():
+            return self.sample_actions(batch)
     
     @abstractmethod
     def sample_actions(self, obs):
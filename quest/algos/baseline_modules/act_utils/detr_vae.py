@@ -4,7 +4,6 @@ DETR model and criterion classes.
 """
 import torch
 from torch import nn
-from torch.autograd import Variable
 from quest.algos.baseline_modules.act_utils.transformer import build_transformer, TransformerEncoder, TransformerEncoderLayer
 
 import numpy as np
@@ -12,7 +11,7 @@ import numpy as np
 
 def reparametrize(mu, logvar):
     std = logvar.div(2).exp()
-    eps = Variable(std.data.new(std.size()).normal_())
+    eps = torch.randn_like(std)
     return mu + std * eps
 
 
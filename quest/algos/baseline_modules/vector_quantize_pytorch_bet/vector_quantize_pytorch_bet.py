@@ -434,6 +434,7 @@ class EuclideanCodebook(nn.Module):
         self.replace(batch_samples, batch_mask = expired_codes)
 
     @autocast(enabled = False)
+    @torch.autocast('cpu', enabled = False)
     def forward(
         self,
         x,
@@ -617,6 +618,7 @@ class CosineSimCodebook(nn.Module):
         self.replace(batch_samples, batch_mask = expired_codes)
 
     @autocast(enabled = False)
+    @torch.autocast('cpu', enabled = False)
     def forward(
         self,
         x,
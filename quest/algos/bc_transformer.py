@@ -51,7 +51,7 @@ class BCTransformerPolicy(Policy):
         dist = self.forward(data)
         loss = self.policy_head.loss_fn(dist, data["actions"], self.reduction)
         info = {
-            'loss': loss.item(),
+            'loss': loss.detach(),
         }
         return loss, info
         
@@ -85,8 +85,8 @@ class BehaviorTransformer(ChunkPolicy):
         action_input = data["actions"][:, :self.skill_block_size, :]
         pred, total_loss, l1_loss, codebook_loss, pp = self.autoencoder(action_input)
         info = {
-            'recon_loss': l1_loss.item(), 
-            'codebook_loss': codebook_loss.item(), 
+            'recon_loss': l1_loss.detach(), 
+            'codebook_loss': codebook_loss.detach(), 
             'pp': pp}
         return total_loss, info
     
@@ -208,17 +208,17 @@ class BehaviorTransformer(ChunkPolicy):
 
         loss = cbet_loss + self._offset_loss_multiplier * offset_loss
         info = {
-            "classification_loss": cbet_loss.detach().cpu().item(),
-            "offset_loss": offset_loss.detach().cpu().item(),
-            "total_loss": loss.detach().cpu().item(),
-            "equal_total_code_rate": equal_total_code_rate.item(),
-            "equal_single_code_rate": equal_single_code_rate.item(),
-            "equal_single_code_rate2": equal_single_code_rate2.item(),
-            "action_diff": action_diff.detach().cpu().item(),
-            "action_diff_tot": action_diff_tot.detach().cpu().item(),
-            "action_diff_mean_res1": action_diff_mean_res1.detach().cpu().item(),
-            "action_diff_mean_res2": action_diff_mean_res2.detach().cpu().item(),
-            "action_diff_max": action_diff_max.detach().cpu().item(),
+            "classification_loss": cbet_loss.detach(),
+            "offset_loss": offset_loss.detach(),
+            "total_loss": loss.detach(),
+            "equal_total_code_rate": equal_total_code_rate.detach(),
+            "equal_single_code_rate": equal_single_code_rate.detach(),
+            "equal_single_code_rate2": equal_single_code_rate2.detach(),
+            "action_diff": action_diff.detach(),
+            "action_diff_tot": action_diff_tot.detach(),
+            "action_diff_mean_res1": action_diff_mean_res1.detach(),
+            "action_diff_mean_res2": action_diff_mean_res2.detach(),
+            "action_diff_max": action_diff_max.detach(),
         }
         return loss, info
 
@@ -20,7 +20,7 @@ class DiffusionPolicy(ChunkPolicy):
         cond = self.get_cond(data)
         loss = self.diffusion_model(cond, data["actions"])
         info = {
-            'loss': loss.item(),
+            'loss': loss.detach(),
         }
         return loss, info
     
@@ -1,12 +1,17 @@
+import os
+import hashlib
+import warnings
 import torch
 import torch.nn.functional as F
 import numpy as np
 import quest.utils.tensor_utils as TensorUtils
 import itertools
 from functools import partial
+from tqdm import tqdm
 
 from quest.algos.base import ChunkPolicy
 from quest.algos.utils.rgb_modules import DINOEncoder
+from quest.utils.dataset import get_sequence_datasets
 
 
 class QueST(ChunkPolicy):
@@ -16,12 +21,16 @@ class QueST(ChunkPolicy):
                  stage,
                  loss_fn,
                  l1_loss_scale,
+                 precompute_skill_tokens=False,
+                 cache_skill_codes=False,
                  **kwargs
                  ):
         super().__init__(**kwargs)
         self.autoencoder = autoencoder
         self.policy_prior = policy_prior
         self.stage = stage
+        self.precompute_skill_tokens = precompute_skill_tokens
+        self.cache_skill_codes = cache_skill_codes
 
         self.start_token = self.policy_prior.start_token
         self.l1_loss_scale = l1_loss_scale if stage == 2 else 0
@@ -105,18 +114,26 @@ class QueST(ChunkPolicy):
             loss = recon_loss
             
         info = {
-            'loss': loss.item(),
-            'recon_loss': recon_loss.item(),
-            'aux_loss': aux_loss.sum().item(),
-            'pp': pp.item(),
-            'pp_sample': pp_sample.item(),
+            'loss': loss.detach(),
+            'recon_loss': recon_loss.detach(),
+            'aux_loss': aux_loss.sum().detach(),
+            'pp': pp.detach(),
+            'pp_sample': pp_sample.detach(),
         }
         return loss, info
 
     def compute_prior_loss(self, data):
         data = self.preprocess_input(data, train_mode=True)
         with torch.no_grad():
-            codes, indices = self.autoencoder.get_indices(data["actions"])
+            if "skill_indices" in data:
+                # targets were precomputed in preprocess_dataset
+                indices = data["skill_indices"].long()
+                if "skill_codes" in data:
+                    codes = data["skill_codes"]
+                elif self.direct_skill_tokens:
+                    codes = self.autoencoder.indices_to_codes(indices)
+            else:
+                codes, indices = self.autoencoder.get_indices(data["actions"])
             indices = indices.long()
         context = self.get_context(data)
         if self.direct_skill_tokens:
@@ -139,12 +156,79 @@ class QueST(ChunkPolicy):
         l1_loss = self.loss(pred_actions, data["actions"])
         total_loss = prior_loss + self.l1_loss_scale * l1_loss
         info = {
-            'loss': total_loss.item(),
-            'nll_loss': prior_loss.item(),
-            'l1_loss': l1_loss.item()
+            'loss': total_loss.detach(),
+            'nll_loss': prior_loss.detach(),
+            'l1_loss': l1_loss.detach()
         }
         return total_loss, info
 
+    def preprocess_dataset(self, dataset, use_tqdm=True):
+        """
+        Since the autoencoder is frozen in stages 1 and 2, tokenize every action window once and
+        attach the skill indices (and optionally codes) to the dataset so that compute_prior_loss
+        doesn't need to run the autoencoder encoder.
+        """
+        if self.stage not in (1, 2) or not self.precompute_skill_tokens:
+            return
+
+        fingerprint = self.get_autoencoder_fingerprint()
+        for sequence_dataset in get_sequence_datasets(dataset):
+            tokens = self.load_or_compute_skill_tokens(sequence_dataset, fingerprint, use_tqdm)
+            sequence_dataset.add_precomputed("skill_indices", tokens["indices"])
+            if "codes" in tokens:
+                sequence_dataset.add_precomputed("skill_codes", tokens["codes"])
+
+    def get_autoencoder_fingerprint(self):
+        hasher = hashlib.sha1()
+        for key, value in sorted(self.autoencoder.state_dict().items()):
+            hasher.update(key.encode())
+            hasher.update(value.detach().cpu().contiguous().numpy().tobytes())
+        return hasher.hexdigest()
+
+    def load_or_compute_skill_tokens(self, sequence_dataset, fingerprint, use_tqdm=True, batch_size=1024):
+        # the cache file is keyed by the autoencoder weights and the windowing of the dataset
+        hasher = hashlib.sha1(fingerprint.encode())
+        hasher.update(repr((sequence_dataset.seq_length,
+                            sequence_dataset.pad_frame_stack,
+                            sequence_dataset.pad_seq_length,
+                            sequence_dataset.n_frame_stack,
+                            list(sequence_dataset.demos),
+                            self.cache_skill_codes)).encode())
+        cache_path = os.path.splitext(sequence_dataset.hdf5_path)[0] \
+            + f'.skill_tokens.{hasher.hexdigest()[:16]}.npz'
+
+        if os.path.exists(cache_path):
+            tokens = dict(np.load(cache_path))
+            if len(tokens["indices"]) == len(sequence_dataset):
+                return tokens
+
+        max_index = self.autoencoder.vq.codebook_size - 1
+        index_dtype = np.int16 if max_index <= np.iinfo(np.int16).max else np.int32
+        all_indices, all_codes = [], []
+        was_training = self.autoencoder.training
+        self.autoencoder.eval()
+        with torch.no_grad():
+            for start in tqdm(range(0, len(sequence_dataset), batch_size), 
+                              disable=not use_tqdm,
+                              desc='tokenizing action windows'):
+                end = min(start + batch_size, len(sequence_dataset))
+                actions = sequence_dataset.get_dataset_items(np.arange(start, end), keys=("actions",))["actions"]
+                actions = torch.from_numpy(actions).float().to(self.device)
+                codes, indices = self.autoencoder.get_indices(actions)
+                all_indices.append(indices.cpu().numpy().astype(index_dtype))
+                if self.cache_skill_codes:
+                    all_codes.append(codes.float().cpu().numpy())
+        self.autoencoder.train(was_training)
+
+        tokens = {"indices": np.concatenate(all_indices)}
+        if self.cache_skill_codes:
+            tokens["codes"] = np.concatenate(all_codes)
+        try:
+            np.savez(cache_path, **tokens)
+        except OSError as e:
+            warnings.warn(f'Could not write skill token cache {cache_path}: {e}')
+        return tokens
+
     def sample_actions(self, data):
         data = self.preprocess_input(data, train_mode=False)
         context = self.get_context(data)
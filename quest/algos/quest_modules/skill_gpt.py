@@ -21,7 +21,8 @@ class SkillGPT(nn.Module):
                  device,
                  full_context_attention,
                  direct_skill_tokens,
-                 skill_token_dim
+                 skill_token_dim,
+                 use_kv_cache=True, # incremental decoding in get_indices_top_k
                  ):
         super().__init__()
         self.action_dim = action_dim
@@ -34,6 +35,7 @@ class SkillGPT(nn.Module):
         self.full_context_attention = full_context_attention
         self.direct_skill_tokens = direct_skill_tokens
         self.skill_token_dim = skill_token_dim
+        self.use_kv_cache = use_kv_cache
 
         self.tok_emb = nn.Linear(skill_token_dim, n_embd) if direct_skill_tokens else nn.Embedding(vocab_size+1, n_embd)
         self.add_positional_emb = Summer(PositionalEncoding1D(n_embd))
@@ -59,11 +61,11 @@ class SkillGPT(nn.Module):
         x = self.add_positional_emb(x)
         x = torch.cat([context, x], dim=1)
         x = self.drop(x)
+        # with is_causal=True the decoder attends causally when training, whatever the mask says,
+        # so context tokens have always been attended causally, also with full_context_attention.
+        # The mask is kept causal so that the fast path used in eval mode, which does use the
+        # mask, matches training
         mask = nn.Transformer.generate_square_subsequent_mask(x.size(1),x.device)
-
-        if self.full_context_attention:
-            mask[:context.size(1), :context.size(1)] = 0.0
-        
         x = self.decoder(x, mask=mask, is_causal=True)
         x = x[:, context.size(1):, :]
         x = self.lnf(x)
@@ -71,18 +73,71 @@ class SkillGPT(nn.Module):
         return logits
         
     def get_indices_top_k(self, context, codebook_size):
+        if self.use_kv_cache:
+            return self.get_indices_top_k_cached(context, codebook_size)
         x = torch.ones((context.shape[0], 1), device=self.device, dtype=torch.long) * self.start_token
         for i in range(self.block_size):
-            if i == self.block_size-1:
-                logits = self.forward(x, context)
-                logits = logits[:,:,:codebook_size]
-            else:
-                logits = self.forward(x, context)
-                logits = logits[:,:,:codebook_size]
+            logits = self.forward(x, context)
+            logits = logits[:,:,:codebook_size]
             next_indices = top_k_sampling(logits[:,-1,:], self.beam_size, self.temperature)
             x = torch.cat([x, next_indices], dim=1)
         return x[:,1:]
-    
+
+    def get_indices_top_k_cached(self, context, codebook_size):
+        """
+        Same sampling procedure as the uncached path, but the context is encoded once and every
+        layer keeps the keys / values of previous positions so that each new skill token only
+        needs a single-position forward pass.
+        """
+        x = torch.ones((context.shape[0], 1), device=self.device, dtype=torch.long) * self.start_token
+        pos_emb = self.add_positional_emb.penc(
+            torch.zeros((1, self.block_size, self.n_embd), device=context.device, dtype=context.dtype))
+        kv_cache = [None] * len(self.decoder.layers)
+
+        # context tokens never attend to skill tokens, so their keys / values are fixed. Like in
+        # forward, they attend to each other causally
+        h = self.drop(context)
+        self._forward_cached(h, kv_cache, is_causal=True)
+
+        next_token = x
+        for i in range(self.block_size):
+            h = self.tok_emb(next_token) + pos_emb[:, i:i+1]
+            h = self.drop(h)
+            h = self._forward_cached(h, kv_cache, is_causal=False)
+            logits = self.head(self.lnf(h))
+            logits = logits[:,:,:codebook_size]
+            next_token = top_k_sampling(logits[:,-1,:], self.beam_size, self.temperature)
+            x = torch.cat([x, next_token], dim=1)
+        return x[:,1:]
+
+    def _forward_cached(self, x, kv_cache, is_causal):
+        """
+        Runs new positions @x through every decoder layer, appending their keys / values to
+        @kv_cache in place. Mirrors nn.TransformerEncoderLayer with norm_first=True.
+        """
+        for layer_idx, layer in enumerate(self.decoder.layers):
+            attn = layer.self_attn
+            B, T, D = x.shape
+            head_dim = D // attn.num_heads
+
+            h = layer.norm1(x)
+            q, k, v = F.linear(h, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+            q, k, v = (t.view(B, T, attn.num_heads, head_dim).transpose(1, 2) for t in (q, k, v))
+            if kv_cache[layer_idx] is not None:
+                past_k, past_v = kv_cache[layer_idx]
+                k = torch.cat([past_k, k], dim=2)
+                v = torch.cat([past_v, v], dim=2)
+            kv_cache[layer_idx] = (k, v)
+
+            h = F.scaled_dot_product_attention(
+                q, k, v,
+                dropout_p=attn.dropout if self.training else 0.0,
+                is_causal=is_causal)
+            h = h.transpose(1, 2).reshape(B, T, D)
+            x = x + layer.dropout1(attn.out_proj(h))
+            x = x + layer._ff_block(layer.norm2(x))
+        return x
+
 def top_k_sampling(logits, k, temperature=1.0):
     # Apply temperature scaling
     scaled_logits = logits / temperature
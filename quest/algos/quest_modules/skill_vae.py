@@ -129,15 +129,30 @@ class SkillVAE(nn.Module):
     def quantize(self, z):
         if self.vq_type == 'vq':
             codes, indices, commitment_loss = self.vq(z)
-            pp = torch.tensor(torch.unique(indices).shape[0] / self.vq.codebook_size, device=z.device)
         else:
             codes, indices = self.vq(z)
             commitment_loss = torch.tensor([0.0], device=z.device)
-            pp = torch.tensor(torch.unique(indices).shape[0] / self.vq.codebook_size, device=z.device)
-        ## pp_sample is the average number of unique indices per sequence while pp is for the whole batch
-        pp_sample = torch.tensor(np.mean([len(torch.unique(index_seq)) for index_seq in indices])/z.shape[1], device=z.device)
+        pp, pp_sample = self.get_codebook_usage(indices)
         return codes, indices, pp, pp_sample, commitment_loss
 
+    @torch.no_grad()
+    def get_codebook_usage(self, indices):
+        """
+        pp is the fraction of the codebook used by the whole batch and pp_sample the average
+        number of unique indices per sequence divided by the sequence length. Counted with
+        static shapes instead of torch.unique, so that torch.compile doesn't break the graph.
+        """
+        seq_len = indices.shape[1]
+        indices = indices.reshape(indices.shape[0], -1).long()
+        used = torch.zeros(self.vq.codebook_size, device=indices.device)
+        used.scatter_(0, indices.flatten(), 1.)
+        pp = used.sum() / self.vq.codebook_size
+
+        sorted_indices = indices.sort(dim=1).values
+        n_unique = 1 + (sorted_indices[:, 1:] != sorted_indices[:, :-1]).sum(dim=1)
+        pp_sample = n_unique.float().mean() / seq_len
+        return pp, pp_sample
+
     def decode(self, codes, obs_emb=None):
         x = self.fixed_positional_emb(torch.zeros((codes.shape[0], self.skill_block_size, self.decoder_dim), dtype=codes.dtype, device=codes.device))
         if obs_emb is not None:
@@ -161,11 +176,15 @@ class SkillVAE(nn.Module):
         codes, indices, _, _, _ = self.quantize(z)
         return codes, indices
     
-    def decode_actions(self, indices):
+    def indices_to_codes(self, indices):
         if self.vq_type == 'fsq':
             codes = self.vq.indices_to_codes(indices)
         else:
             codes = self.vq.get_output_from_indices(indices)
+        return codes
+
+    def decode_actions(self, indices):
+        codes = self.indices_to_codes(indices)
         x = self.decode(codes)
         return x
 
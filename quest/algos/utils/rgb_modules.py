@@ -193,6 +193,7 @@ class ResnetEncoder(nn.Module):
         freeze: whether   freeze the pretrained resnet
         remove_layer_num: remove the top # layers
         no_stride:        do not use striding
+        channels_last:    run the convolutions on channels last (NHWC) tensors
     """
 
     def __init__(
@@ -207,6 +208,7 @@ class ResnetEncoder(nn.Module):
         language_fusion="film",
         do_projection=True,
         keep_tokens=False,
+        channels_last=False,
     ):
 
         super().__init__()
@@ -306,7 +308,14 @@ class ResnetEncoder(nn.Module):
             self.projection_layer = None
             self.out_channels = y.shape[-1]
 
+        # NHWC lets oneDNN on cpu and tensor cores on gpu run convolutions without layout conversions
+        self.channels_last = channels_last
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+
     def forward(self, x, langs=None):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         x = self.normalizer(x)
         h = self.resnet18_base(x)
 
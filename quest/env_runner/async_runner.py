@@ -0,0 +1,142 @@
+import atexit
+import queue
+import time
+import traceback
+import multiprocessing
+
+from hydra.utils import instantiate
+from omegaconf import OmegaConf
+
+import quest.utils.utils as utils
+
+
+def _rollout_worker(cfg, job_queue, result_queue):
+    """
+    Builds the policy and env runner described by the resolved config @cfg once, then runs
+    rollouts with the weights of every job until it receives None.
+    """
+    cfg = OmegaConf.create(cfg)
+    model = instantiate(cfg.algo.policy, shape_meta=cfg.task.shape_meta)
+    model.to(cfg.device)
+    model.eval()
+    env_runner = instantiate(cfg.task.env_runner)
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        step, epoch, state_dict = job
+        try:
+            model.load_state_dict(state_dict)
+            del state_dict
+            rollout_results = env_runner.run(model, n_video=cfg.rollout.n_video, do_tqdm=False)
+            result_queue.put((step, epoch, rollout_results, None))
+        except Exception:
+            result_queue.put((step, epoch, None, traceback.format_exc()))
+
+
+class AsyncRolloutRunner():
+    """
+    Runs rollouts in separate processes while training continues. Each call to @submit sends a
+    cpu copy of the policy weights to a pool of workers, each of which owns its own policy and
+    env runner built from the training config, and @poll returns the results of finished
+    rollouts along with the step at which the weights were taken.
+
+    Args:
+        cfg (DictConfig): training config, used to build the policy and the env runner in workers
+        num_workers (int): number of worker processes, i.e. of rollouts running at the same time
+        device (str): device of the policies in the workers. Defaults to cfg.device
+    """
+    def __init__(self, cfg, num_workers=1, device=None):
+        cfg = cfg.copy()
+        if device is not None:
+            cfg.device = device
+        # resolve here, so that workers don't need the resolvers registered by the training script
+        cfg = OmegaConf.to_container(cfg, resolve=True)
+
+        # spawn since the training process may hold cuda contexts and open hdf5 files, and
+        # workers are not daemonic so that env runners can start their own processes
+        ctx = multiprocessing.get_context("spawn")
+        self.job_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.workers = []
+        for _ in range(num_workers):
+            worker = ctx.Process(target=_rollout_worker, args=(cfg, self.job_queue, self.result_queue))
+            worker.start()
+            self.workers.append(worker)
+        self.num_pending = 0
+        self.completed = []
+        self.closed = False
+        # workers only exit once they receive None, so the process would hang at exit joining
+        # them if training stopped without calling close, e.g. because of an exception
+        atexit.register(self.shutdown)
+
+    def submit(self, model, step, epoch):
+        """
+        Queue a rollout of the current weights of @model. If every worker is still busy with a
+        previous rollout, wait for one to finish first, which bounds the number of weight copies
+        in flight.
+        """
+        if self.num_pending >= len(self.workers):
+            self.completed.append(self._get_result(block=True))
+        state_dict = utils.snapshot_state_dicts(model)
+        self.job_queue.put((step, epoch, state_dict))
+        self.num_pending += 1
+
+    def _get_result(self, block):
+        while True:
+            try:
+                result = self.result_queue.get(block=block, timeout=10 if block else None)
+                break
+            except queue.Empty:
+                if not block:
+                    raise
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("a rollout worker exited unexpectedly")
+        self.num_pending -= 1
+        step, epoch, rollout_results, error = result
+        if error is not None:
+            raise RuntimeError(f"rollout of the weights from step {step} failed:\n{error}")
+        return step, epoch, rollout_results
+
+    def poll(self, block=False):
+        """
+        Returns a list of (step, epoch, rollout_results) of the rollouts that finished since the
+        last call. If @block, wait for all pending rollouts.
+        """
+        completed, self.completed = self.completed, []
+        while self.num_pending > 0:
+            try:
+                completed.append(self._get_result(block=block))
+            except queue.Empty:
+                break
+        return completed
+
+    def close(self):
+        """
+        Wait for pending rollouts and stop the workers. Returns the results that were not polled yet.
+        """
+        completed = self.poll(block=True)
+        self.shutdown()
+        return completed
+
+    def shutdown(self, timeout=10):
+        """
+        Stop the workers without waiting for pending rollouts. Workers that are still running a
+        rollout after @timeout seconds are terminated.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.shutdown)
+        for _ in self.workers:
+            self.job_queue.put(None)
+        # jobs that no worker will read anymore must not block the exit of this process
+        self.job_queue.cancel_join_thread()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
@@ -0,0 +1,408 @@
+"""
+Utilities for benchmarking policies and data pipelines on synthetic data, so that benchmarks
+don't need the simulation benchmarks or the real datasets to be installed.
+"""
+import os
+import time
+
+import h5py
+import numpy as np
+import torch
+from hydra import compose, initialize_config_dir
+from hydra.utils import instantiate
+from omegaconf import OmegaConf
+
+import quest.utils.obs_utils as ObsUtils
+import quest.utils.utils as utils
+from quest.utils.dataset import SequenceDataset, BatchedConcatDataset, collate_batch
+
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "config")
+
+
+def compose_config(config_name="train_prior", overrides=None):
+    """
+    Compose the training config @config_name of config/ with the hydra @overrides, outside of
+    a hydra app, e.g. in benchmark scripts.
+    """
+    OmegaConf.register_new_resolver("eval", eval, replace=True)
+    with initialize_config_dir(config_dir=os.path.abspath(CONFIG_DIR), version_base=None):
+        return compose(config_name=config_name, overrides=list(overrides or []))
+
+
+def load_policy(algo, task, device="cpu", overrides=None, config_name="train_prior"):
+    """
+    Build the randomly initialized policy of @algo for @task, seeded with the seed of the config.
+
+    Args:
+        algo (str): algo config, e.g. "quest"
+        task (str): task config providing the shape_meta, e.g. "metaworld_ml45"
+        device (str): device of the policy
+        overrides (list): extra hydra overrides
+        config_name (str): training config, e.g. "train_autoencoder" for stage 0
+
+    Returns:
+        policy (Policy): the policy on @device
+        cfg (DictConfig): the composed config
+    """
+    cfg = compose_config(config_name, [f"algo={algo}", f"task={task}", f"device={device}", *(overrides or [])])
+    torch.manual_seed(cfg.seed)
+    policy = instantiate(cfg.algo.policy, shape_meta=cfg.task.shape_meta).to(device)
+    return policy, cfg
+
+
+def write_synthetic_hdf5(path, shape_meta, n_demos=10, demo_length=100, seed=0, compression=None):
+    """
+    Write a robomimic-style hdf5 dataset of random demos matching @shape_meta.
+
+    Args:
+        path (str): path of the hdf5 file
+        shape_meta (dict): shape_meta of a task config. rgb observations are stored as uint8
+            (H, W, C) images and lowdim observations and actions as float64
+        n_demos (int): number of demos
+        demo_length (int or tuple): length of every demo, or (min, max) bounds of
+            uniformly sampled lengths
+        seed (int): random seed
+        compression (str): h5py compression filter of the datasets, e.g. "gzip"
+    """
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, "w") as f:
+        data = f.create_group("data")
+        for i in range(n_demos):
+            if isinstance(demo_length, int):
+                length = demo_length
+            else:
+                length = int(rng.integers(demo_length[0], demo_length[1] + 1))
+            demo = data.create_group(f"demo_{i}")
+            demo.attrs["num_samples"] = length
+            for key, (c, h, w) in shape_meta["observation"]["rgb"].items():
+                demo.create_dataset(f"obs/{key}", data=rng.integers(0, 256, (length, h, w, c), dtype=np.uint8),
+                                    compression=compression)
+            for key, dim in shape_meta["observation"]["lowdim"].items():
+                demo.create_dataset(f"obs/{key}", data=rng.normal(size=(length, dim)), compression=compression)
+            demo.create_dataset("actions", data=rng.uniform(-1, 1, (length, shape_meta["action_dim"])),
+                                compression=compression)
+
+
+def write_synthetic_benchmark(root, shape_meta, n_tasks=5, n_demos=10, demo_length=100, seed=0,
+                              task_names=None, compression=None):
+    """
+    Write one synthetic hdf5 dataset per task in @root (see @write_synthetic_hdf5), the way task
+    datasets are laid out under <data_prefix>/<suite_name>/<benchmark_name>/<mode>.
+
+    Args:
+        task_names (list): names of the hdf5 files (without extension), e.g. the task names of
+            the benchmark that is replaced. Defaults to task_000, task_001, ...
+
+    Returns:
+        paths (list): paths of the hdf5 files, in task order
+    """
+    if task_names is None:
+        task_names = [f"task_{i:03d}" for i in range(n_tasks)]
+    assert len(task_names) == n_tasks
+    os.makedirs(root, exist_ok=True)
+    paths = []
+    for i, task_name in enumerate(task_names):
+        path = os.path.join(root, f"{task_name}.hdf5")
+        write_synthetic_hdf5(path, shape_meta, n_demos=n_demos, demo_length=demo_length, seed=seed + i,
+                             compression=compression)
+        paths.append(path)
+    return paths
+
+
+def make_synthetic_dataset(cfg, hdf5_path, load_obs=True, hdf5_cache_mode="all"):
+    """
+    Build a SequenceDataset over the synthetic dataset at @hdf5_path (see @write_synthetic_hdf5)
+    with the sequence settings of the algo in @cfg, i.e. returning the same samples as the
+    datasets of the training config @cfg. If @hdf5_path is a list of paths (see
+    @write_synthetic_benchmark), returns a BatchedConcatDataset of one dataset per path like the
+    multitask datasets.
+    """
+    if not isinstance(hdf5_path, str):
+        return BatchedConcatDataset([
+            make_synthetic_dataset(cfg, path, load_obs=load_obs, hdf5_cache_mode=hdf5_cache_mode)
+            for path in hdf5_path
+        ])
+    shape_meta = cfg.task.shape_meta
+    obs_modality = {
+        "rgb": list(shape_meta.observation.rgb.keys()),
+        "low_dim": list(shape_meta.observation.lowdim.keys()),
+    }
+    ObsUtils.initialize_obs_utils_with_obs_specs({"obs": obs_modality})
+    dataset_cfg = cfg.algo.dataset
+    return SequenceDataset(
+        hdf5_path=hdf5_path,
+        obs_keys=obs_modality["rgb"] + obs_modality["low_dim"] if load_obs else [],
+        dataset_keys=list(dataset_cfg.dataset_keys),
+        load_next_obs=dataset_cfg.load_next_obs,
+        frame_stack=dataset_cfg.frame_stack,
+        seq_length=dataset_cfg.seq_len,
+        obs_seq_length=dataset_cfg.obs_seq_len,
+        lowdim_obs_seq_length=dataset_cfg.lowdim_obs_seq_len,
+        pad_frame_stack=True,
+        pad_seq_length=True,
+        hdf5_cache_mode=hdf5_cache_mode,
+    )
+
+
+def get_synthetic_batch(cfg, dataset, batch_size, seed=0):
+    """
+    Returns a batch of @batch_size random samples of @dataset on cfg.device, with the task
+    conditioning of the task in @cfg.
+    """
+    rng = np.random.default_rng(seed)
+    batch = dataset.__getitems__(rng.integers(0, len(dataset), batch_size).tolist())
+    task_meta = cfg.task.shape_meta.task
+    if task_meta.type == "onehot":
+        batch["task_id"] = torch.as_tensor(rng.integers(0, task_meta.n_tasks, batch_size), dtype=torch.long)
+    else:
+        batch["task_emb"] = torch.randn(batch_size, task_meta.dim)
+    return utils.map_tensor_to_device(batch, cfg.device)
+
+
+def time_dataset(dataset, batch_size=128, n_batches=20, seed=0):
+    """
+    Time fetching random batches from @dataset through __getitems__, the way DataLoaders with
+    @collate_batch fetch them, without worker processes.
+
+    Returns:
+        samples_per_sec (float): number of samples fetched per second
+    """
+    rng = np.random.default_rng(seed)
+    batches = [rng.integers(0, len(dataset), batch_size).tolist() for _ in range(n_batches)]
+    t0 = time.perf_counter()
+    for indices in batches:
+        dataset.__getitems__(indices)
+    return n_batches * batch_size / (time.perf_counter() - t0)
+
+
+def time_dataloader(dataset, batch_size=128, num_workers=0, n_batches=20, n_warmup=2, **dataloader_kwargs):
+    """
+    Time iterating over a shuffled DataLoader over @dataset with @num_workers workers. The
+    first @n_warmup batches, which include starting the workers, are not timed.
+
+    Returns:
+        samples_per_sec (float): number of samples loaded per second
+    """
+    loader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        collate_fn=collate_batch,
+        **dataloader_kwargs,
+    )
+    n_batches = min(n_batches, len(loader) - n_warmup - 1)
+    assert n_batches > 0, "the dataset is too small for the number of batches"
+    num_samples = 0
+    for i, batch in enumerate(loader):
+        if i == n_warmup:
+            t0 = time.perf_counter()
+        elif i > n_warmup:
+            num_samples += len(batch["actions"])
+        if i == n_warmup + n_batches:
+            break
+    return num_samples / (time.perf_counter() - t0)
+
+
+def _synchronize(device):
+    if utils.get_device_type(device) == "cuda":
+        torch.cuda.synchronize()
+
+
+def time_training_steps(model, batch, n_iters=20, n_warmup=3, use_amp=False, amp_dtype=None):
+    """
+    Time full training steps (forward, backward and optimizer step, as in train.py) of @model on
+    @batch.
+
+    Returns:
+        times (np.ndarray): duration of every timed step in milliseconds
+    """
+    device = model.device
+    model.train()
+    optimizers = model.get_optimizers()
+    scaler = utils.get_grad_scaler(device, enabled=use_amp, amp_dtype=amp_dtype)
+    times = []
+    for i in range(n_warmup + n_iters):
+        # compute_loss may modify the batch in place
+        data = {k: dict(v) if isinstance(v, dict) else v for k, v in batch.items()}
+        _synchronize(device)
+        t0 = time.perf_counter()
+        for optimizer in optimizers:
+            optimizer.zero_grad()
+        with utils.autocast(device, enabled=use_amp, amp_dtype=amp_dtype):
+            loss, _ = model.compute_loss(data)
+        scaler.scale(loss).backward()
+        for optimizer in optimizers:
+            scaler.step(optimizer)
+        scaler.update()
+        _synchronize(device)
+        if i >= n_warmup:
+            times.append(time.perf_counter() - t0)
+    return np.array(times) * 1000
+
+
+def explain_graph_breaks(fn, *args, **kwargs):
+    """
+    Trace @fn on the given inputs with torch._dynamo.explain, without compiling it.
+
+    Returns:
+        n_graphs (int): number of graphs dynamo splits @fn into
+        break_reasons (list): the distinct reasons of its graph breaks, with the code location
+            of each break
+    """
+    explanation = torch._dynamo.explain(fn)(*args, **kwargs)
+    break_reasons = []
+    for reason in explanation.break_reasons:
+        location = ""
+        if reason.user_stack:
+            frame = reason.user_stack[-1]
+            location = f" ({frame.filename}:{frame.lineno})"
+        description = reason.reason.strip().splitlines()[0] + location
+        if description not in break_reasons:
+            break_reasons.append(description)
+    return explanation.graph_count, break_reasons
+
+
+class StubEnv:
+    """
+    Stand-in for the vectorized, frame stacked simulation envs, so that policies can be rolled
+    out without LIBERO or MetaWorld installed. Observations are random, with the shapes of
+    @shape_meta: rgb observations are uint8 (n_envs, frame_stack, H, W, C) images and lowdim
+    observations float64 (n_envs, frame_stack, dim) arrays, like the observations of the env
+    runners. Actions are ignored and episodes never end. Stepping sleeps for @step_ms, to
+    stand in for simulation and rendering, which policies can overlap with (see ChunkPolicy).
+
+    Args:
+        shape_meta (dict): shape_meta of a task config
+        n_envs (int): number of parallel envs, i.e. the batch size of the policy
+        frame_stack (int): number of stacked past observations
+        n_frames (int): number of distinct observations that are cycled through, so that
+            stepping the env is cheap
+        seed (int): random seed
+        step_ms (float): duration of every step in milliseconds
+    """
+    def __init__(self, shape_meta, n_envs=1, frame_stack=1, n_frames=16, seed=0, step_ms=0.):
+        self.step_ms = step_ms
+        rng = np.random.default_rng(seed)
+        self.frames = []
+        for _ in range(n_frames):
+            obs = {}
+            for key, (c, h, w) in shape_meta["observation"]["rgb"].items():
+                obs[key] = rng.integers(0, 256, (n_envs, frame_stack, h, w, c), dtype=np.uint8)
+            for key, dim in shape_meta["observation"]["lowdim"].items():
+                obs[key] = rng.normal(size=(n_envs, frame_stack, dim))
+            self.frames.append(obs)
+        self.t = 0
+
+    def _get_obs(self):
+        # copies, since policies may convert the observations in place
+        return {key: value.copy() for key, value in self.frames[self.t % len(self.frames)].items()}
+
+    def reset(self):
+        self.t = 0
+        return self._get_obs(), {}
+
+    def step(self, action):
+        if self.step_ms > 0:
+            time.sleep(self.step_ms / 1000)
+        self.t += 1
+        return self._get_obs(), 0., False, False, {}
+
+
+def profile_get_action(policy, env, n_steps=100, n_warmup=10, task_id=0, task_emb=None):
+    """
+    Roll out @policy in @env (see @StubEnv) and time every call of policy.get_action. Calls
+    are broken down into
+        - obs_conversion: policy.prepare_batch and policy.preprocess_input, i.e. converting the
+          numpy observations to normalized tensors on the policy's device
+        - encode: forward passes of the observation and task encoders
+        - decode: the rest of sample_actions, i.e. predicting actions from the encodings and
+          copying them back to the host
+    For chunk policies, calls that are served from the action queue don't run any of these.
+    On cuda, the device is synchronized around every phase, which adds a little latency. When
+    chunks are prefetched (see ChunkPolicy), the phases run in a background thread and are
+    attributed to the call that they finish in.
+
+    Args:
+        policy (Policy): policy to profile, reset before the rollout
+        env (StubEnv): env providing the observations
+        n_steps (int): number of timed calls
+        n_warmup (int): number of untimed calls before, e.g. for cudnn autotuning
+        task_id (int): task id passed to get_action
+        task_emb (torch.Tensor): task embeddings passed to get_action, for tasks with vector
+            task conditioning
+
+    Returns:
+        timings (dict): arrays with one entry per timed call of
+            - latency_ms: duration of get_action
+            - sampled: whether the call started with an empty action queue, i.e. needed a new
+              chunk. Always true for policies that don't predict chunks
+            - obs_conversion_ms, encode_ms, decode_ms: duration of every phase
+    """
+    device = policy.device
+    phase_ms = {"prepare_batch": 0., "preprocess_input": 0., "encode": 0., "sample_actions": 0.}
+
+    def timed(fn, phase):
+        def wrapper(*args, **kwargs):
+            _synchronize(device)
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            _synchronize(device)
+            phase_ms[phase] += (time.perf_counter() - t0) * 1000
+            return result
+        return wrapper
+
+    encoder_start = {}
+
+    def encoder_pre_hook(module, args):
+        _synchronize(device)
+        encoder_start[module] = time.perf_counter()
+
+    def encoder_hook(module, args, output):
+        _synchronize(device)
+        phase_ms["encode"] += (time.perf_counter() - encoder_start.pop(module)) * 1000
+
+    # the methods are wrapped on this instance only and restored afterwards
+    wrapped = ("prepare_batch", "preprocess_input", "sample_actions")
+    instance_methods = {name: policy.__dict__.get(name) for name in wrapped}
+    for name in wrapped:
+        setattr(policy, name, timed(getattr(policy, name), name))
+    encoders = list(policy.image_encoders.values()) + list(policy.lowdim_encoders.values()) + [policy.task_encoder]
+    handles = []
+    for encoder in encoders:
+        handles.append(encoder.register_forward_pre_hook(encoder_pre_hook))
+        handles.append(encoder.register_forward_hook(encoder_hook))
+
+    timings = {key: [] for key in ("latency_ms", "sampled", "obs_conversion_ms", "encode_ms", "decode_ms")}
+    try:
+        policy.reset()
+        obs, _ = env.reset()
+        for i in range(n_warmup + n_steps):
+            for phase in phase_ms:
+                phase_ms[phase] = 0.
+            sampled = len(getattr(policy, "action_queue", None) or []) == 0
+            _synchronize(device)
+            t0 = time.perf_counter()
+            action = policy.get_action(obs, task_id, task_emb)
+            _synchronize(device)
+            latency = (time.perf_counter() - t0) * 1000
+            obs, _, _, _, _ = env.step(action)
+            if i < n_warmup:
+                continue
+            timings["latency_ms"].append(latency)
+            timings["sampled"].append(sampled)
+            timings["obs_conversion_ms"].append(phase_ms["prepare_batch"] + phase_ms["preprocess_input"])
+            timings["encode_ms"].append(phase_ms["encode"])
+            # preprocess_input and the encoders run within sample_actions
+            timings["decode_ms"].append(
+                phase_ms["sample_actions"] - phase_ms["preprocess_input"] - phase_ms["encode"])
+    finally:
+        for handle in handles:
+            handle.remove()
+        for name, method in instance_methods.items():
+            if method is None:
+                delattr(policy, name)
+            else:
+                setattr(policy, name, method)
+    return {key: np.array(value) for key, value in timings.items()}
@@ -0,0 +1,212 @@
+"""
+Columnar copies of robomimic-style hdf5 datasets, made of flat, memory-mapped numpy arrays.
+
+For a dataset at <name>.hdf5 the columnar copy is a directory <name>.columnar containing
+    meta.json: format version, stats of the source file, demo names, lengths and offsets,
+        dtype and shape of every key and the filter masks of the source file
+    <key>.npy: the entries of every demo for one key (e.g. obs/agentview_rgb is stored in
+        obs.agentview_rgb.npy) concatenated in the order of the demos
+
+Reading a window of a demo is then a slice of a memory map, which needs neither h5py nor a
+decompression step, and the operating system page cache is shared by every process reading
+the same dataset.
+"""
+import os
+import json
+import shutil
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+
+COLUMNAR_FORMAT_VERSION = 2
+
+
+def get_columnar_path(hdf5_path):
+    """
+    Returns the path of the columnar copy of the dataset at @hdf5_path.
+    """
+    return os.path.splitext(os.path.expanduser(hdf5_path))[0] + ".columnar"
+
+
+def get_source_stats(hdf5_path):
+    stat = os.stat(hdf5_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def is_columnar_up_to_date(hdf5_path, columnar_path=None):
+    """
+    Whether the columnar copy of @hdf5_path exists and was converted from the current version
+    of the file.
+    """
+    columnar_path = get_columnar_path(hdf5_path) if columnar_path is None else columnar_path
+    meta_path = os.path.join(columnar_path, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    return meta["version"] == COLUMNAR_FORMAT_VERSION \
+        and meta["source"] == get_source_stats(os.path.expanduser(hdf5_path))
+
+
+def _key_to_filename(key):
+    return key.replace("/", ".") + ".npy"
+
+
+def convert_hdf5_to_columnar(hdf5_path, columnar_path=None, overwrite=False, verbose=True):
+    """
+    Convert the hdf5 dataset at @hdf5_path to the columnar format. uint8 keys (images) keep
+    their dtype and every other key is stored as float32, which is how SequenceDataset caches
+    them in memory.
+
+    Args:
+        hdf5_path (str): path to the hdf5 dataset
+        columnar_path (str): output directory. Defaults to @get_columnar_path(hdf5_path)
+        overwrite (bool): if True, convert even if an up to date copy exists
+        verbose (bool): if True, print progress
+
+    Returns:
+        columnar_path (str): path of the columnar copy
+    """
+    hdf5_path = os.path.expanduser(hdf5_path)
+    columnar_path = get_columnar_path(hdf5_path) if columnar_path is None else columnar_path
+    if not overwrite and is_columnar_up_to_date(hdf5_path, columnar_path):
+        return columnar_path
+
+    # write to a temporary directory first so that readers never see a partial conversion
+    tmp_path = "{}.tmp-{}".format(columnar_path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    source_stats = get_source_stats(hdf5_path)
+    with h5py.File(hdf5_path, "r") as f:
+        # file order, so that the first n_demos are the same as when reading the hdf5 file
+        demos = list(f["data"].keys())
+        lengths = [int(f["data/{}".format(ep)].attrs["num_samples"]) for ep in demos]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+
+        # keys are all per-timestep datasets of the first demo that every demo has
+        keys = []
+        f["data/{}".format(demos[0])].visititems(
+            lambda name, obj: keys.append(name) if isinstance(obj, h5py.Dataset) else None)
+        keys = [k for k in keys if all(
+            k in f["data/{}".format(ep)] and f["data/{}/{}".format(ep, k)].shape[0] == length
+            for ep, length in zip(demos, lengths))]
+
+        masks = dict()
+        if "mask" in f:
+            for name in f["mask"]:
+                masks[name] = [elem.decode("utf-8") for elem in np.array(f["mask/{}".format(name)][:])]
+
+        key_meta = dict()
+        for k in tqdm(keys, disable=not verbose, desc="converting {}".format(os.path.basename(hdf5_path))):
+            source = f["data/{}/{}".format(demos[0], k)]
+            dtype = np.uint8 if source.dtype == np.uint8 else np.float32
+            shape = (offsets[-1], *source.shape[1:])
+            column = np.lib.format.open_memmap(
+                os.path.join(tmp_path, _key_to_filename(k)), mode="w+", dtype=dtype, shape=shape)
+            for ep, start, end in zip(demos, offsets[:-1], offsets[1:]):
+                column[start:end] = f["data/{}/{}".format(ep, k)][()]
+            column.flush()
+            del column
+            key_meta[k] = {"dtype": np.dtype(dtype).str, "shape": list(shape[1:])}
+
+    meta = {
+        "version": COLUMNAR_FORMAT_VERSION,
+        "source": source_stats,
+        "demos": demos,
+        "lengths": lengths,
+        "offsets": offsets[:-1],
+        "keys": key_meta,
+        "masks": masks,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    if os.path.exists(columnar_path):
+        shutil.rmtree(columnar_path)
+    try:
+        os.rename(tmp_path, columnar_path)
+    except OSError:
+        # another process finished converting the same file first
+        shutil.rmtree(tmp_path)
+        if not is_columnar_up_to_date(hdf5_path, columnar_path):
+            raise
+    return columnar_path
+
+
+class ColumnarDataset(object):
+    """
+    Reader for the columnar copy of a dataset (see @convert_hdf5_to_columnar). Columns are
+    opened as read-only memory maps on first access. Pickling only sends the path, so copies in
+    other processes map the same files.
+
+    Args:
+        columnar_path (str): path of the columnar copy
+    """
+    def __init__(self, columnar_path):
+        self.columnar_path = columnar_path
+        with open(os.path.join(columnar_path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        assert meta["version"] == COLUMNAR_FORMAT_VERSION, \
+            "columnar dataset at {} has an unsupported format version".format(columnar_path)
+        self.demos = meta["demos"]
+        self.demo_lengths = dict(zip(self.demos, meta["lengths"]))
+        self.demo_offsets = dict(zip(self.demos, meta["offsets"]))
+        self.num_samples = sum(meta["lengths"])
+        self.key_meta = meta["keys"]
+        self.masks = meta["masks"]
+        self._columns = dict()
+        self._extra_columns = dict()
+
+    def add_column(self, key, array):
+        """
+        Add an in-memory column @array of shape [num_samples, ...] under @key, e.g. to fill in
+        keys that are missing from the source file. Unlike memory mapped columns, it is pickled.
+        """
+        assert len(array) == self.num_samples
+        self._extra_columns[key] = array
+
+    def keys(self):
+        return list(self.key_meta.keys()) + list(self._extra_columns.keys())
+
+    def __contains__(self, key):
+        return key in self.key_meta or key in self._extra_columns
+
+    def __getitem__(self, key):
+        """
+        Returns the column for @key as a read-only memory map of shape [num_samples, ...].
+        """
+        if key in self._extra_columns:
+            return self._extra_columns[key]
+        if key not in self._columns:
+            self._columns[key] = np.load(
+                os.path.join(self.columnar_path, _key_to_filename(key)), mmap_mode="r")
+        return self._columns[key]
+
+    def get_demo(self, ep, key):
+        """
+        Returns the entries of @key for demo @ep as a view into the memory map.
+        """
+        start = self.demo_offsets[ep]
+        return self[key][start:start + self.demo_lengths[ep]]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_columns"] = dict()
+        return state
+
+
+def load_columnar_dataset(hdf5_path, convert=True, verbose=True):
+    """
+    Open the columnar copy of the dataset at @hdf5_path, converting the file first if the
+    copy is missing or out of date and @convert is True.
+    """
+    columnar_path = get_columnar_path(hdf5_path)
+    if not is_columnar_up_to_date(hdf5_path, columnar_path):
+        if not convert:
+            raise FileNotFoundError("no up to date columnar copy of {}".format(hdf5_path))
+        convert_hdf5_to_columnar(hdf5_path, columnar_path, verbose=verbose)
+    return ColumnarDataset(columnar_path)
@@ -6,8 +6,11 @@ This file is adapted from Robomimic
 https://github.com/ARISE-Initiative/robomimic/blob/master/robomimic/utils/dataset.py
 """
 import os
+import time
 import h5py
 import numpy as np
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from copy import deepcopy
 from contextlib import contextmanager
 
@@ -15,6 +18,9 @@ import torch.utils.data
 
 import quest.utils.tensor_utils as TensorUtils
 import quest.utils.obs_utils as ObsUtils
+import quest.utils.file_utils as FileUtils
+import quest.utils.columnar_utils as ColumnarUtils
+from quest.utils.shared_memory_utils import SharedArrayDict
 from tqdm import tqdm
 
 
@@ -33,6 +39,7 @@ class SequenceDataset(torch.utils.data.Dataset):
         get_pad_mask=False,
         goal_mode=None,
         hdf5_cache_mode=None,
+        hdf5_cache_backend="numpy",
         hdf5_use_swmr=True,
         hdf5_normalize_obs=False,
         filter_by_attribute=None,
@@ -69,11 +76,21 @@ class SequenceDataset(torch.utils.data.Dataset):
 
             goal_mode (str): either "last" or None. Defaults to None, which is to not fetch goals
 
-            hdf5_cache_mode (str): one of ["all", "low_dim", or None]. Set to "all" to cache entire hdf5 
+            hdf5_cache_mode (str): one of ["all", "low_dim", "mmap", or None]. Set to "all" to cache entire hdf5 
                 in memory - this is by far the fastest for data loading. Set to "low_dim" to cache all 
                 non-image data. Set to None to use no caching - in this case, every batch sample is 
                 retrieved via file i/o. You should almost never set this to None, even for large 
-                image datasets.
+                image datasets. Cached keys are stored once per demo and sequences are returned as
+                views into the cache, so they should not be modified in place. Set to "mmap" to
+                read every key from memory-mapped columnar copies of the file instead (see
+                @ColumnarUtils.convert_hdf5_to_columnar), which are created next to the hdf5 file
+                if missing or out of date. This needs little memory, doesn't use h5py after the
+                conversion and shares the page cache between processes.
+
+            hdf5_cache_backend (str): one of ["numpy", "shared_memory"]. Set to "shared_memory" to keep
+                the in-memory cache in a single shared memory block (see @share_memory), so that
+                DataLoader workers map the cache instead of copying it, which keeps memory usage
+                flat in the number of workers with any multiprocessing context.
 
             hdf5_use_swmr (bool): whether to use swmr feature when opening the hdf5 file. This ensures
                 that multiple Dataset instances can all access the same hdf5 file without problems.
@@ -93,8 +110,16 @@ class SequenceDataset(torch.utils.data.Dataset):
         self.hdf5_normalize_obs = hdf5_normalize_obs
         self._hdf5_file = None
 
-        assert hdf5_cache_mode in ["all", "low_dim", None]
+        assert hdf5_cache_mode in ["all", "low_dim", "mmap", None]
         self.hdf5_cache_mode = hdf5_cache_mode
+        assert hdf5_cache_backend in ["numpy", "shared_memory"]
+        self.hdf5_cache_backend = hdf5_cache_backend
+        # memory maps are already shared through the page cache
+        assert not (hdf5_cache_mode == "mmap" and hdf5_cache_backend == "shared_memory")
+
+        self.columnar = None
+        if self.hdf5_cache_mode == "mmap":
+            self.columnar = ColumnarUtils.load_columnar_dataset(self.hdf5_path)
 
         self.load_next_obs = load_next_obs
         self.filter_by_attribute = filter_by_attribute
@@ -124,12 +149,24 @@ class SequenceDataset(torch.utils.data.Dataset):
 
         self.few_demos = few_demos
 
+        # per-sequence arrays attached after construction (see @add_precomputed)
+        self.precomputed = dict()
+
+        # demo keys and lengths are read from an index sidecar next to the file, which is
+        # only rebuilt when the file changes (see @FileUtils.get_dataset_index)
+        self.dataset_index = FileUtils.get_dataset_index(self.hdf5_path)
+
         self.load_demo_info(filter_by_attribute=self.filter_by_attribute, demos=self.few_demos, n_demos=n_demos)
 
         # maybe prepare for observation normalization
         self.obs_normalization_stats = None
         if self.hdf5_normalize_obs:
-            self.obs_normalization_stats = self.normalize_obs()
+            self.obs_normalization_stats = FileUtils.load_normalization_stats(
+                self.dataset_index, self.obs_keys, self.demos)
+            if self.obs_normalization_stats is None:
+                self.obs_normalization_stats = self.normalize_obs()
+                FileUtils.save_normalization_stats(
+                    self.hdf5_path, self.dataset_index, self.obs_keys, self.demos, self.obs_normalization_stats)
 
         # maybe store dataset in memory for fast access
         if self.hdf5_cache_mode in ["all", "low_dim"]:
@@ -149,16 +186,11 @@ class SequenceDataset(torch.utils.data.Dataset):
                 dataset_keys=self.dataset_keys,
                 load_next_obs=self.load_next_obs
             )
-
-            if self.hdf5_cache_mode == "all":
-                # cache getitem calls for even more speedup. We don't do this for
-                # "low-dim" since image observations require calls to getitem anyways.
-                print("SequenceDataset: caching get_item calls...")
-                self.getitem_cache = [self.get_item(i) for i in tqdm(range(len(self)))]
-
-                # don't need the previous cache anymore
-                del self.hdf5_cache
-                self.hdf5_cache = None
+            if self.hdf5_cache_backend == "shared_memory":
+                self.share_memory()
+        elif self.hdf5_cache_mode == "mmap":
+            self.obs_keys_in_memory = self.obs_keys
+            self.hdf5_cache = self.load_dataset_mmap(demo_list=self.demos, dataset_keys=self.dataset_keys)
         else:
             self.hdf5_cache = None
 
@@ -178,9 +210,9 @@ class SequenceDataset(torch.utils.data.Dataset):
         if demos is not None:
             self.demos = demos
         elif filter_by_attribute is not None:
-            self.demos = [elem.decode("utf-8") for elem in np.array(self.hdf5_file["mask/{}".format(filter_by_attribute)][:])]
+            self.demos = list(self.dataset_index["masks"][filter_by_attribute])
         else:
-            self.demos = list(self.hdf5_file["data"].keys())
+            self.demos = list(self.dataset_index["demos"])
         
         if n_demos is not None:
             assert n_demos <= len(self.demos), 'asking for more demos than available in the dataset'
@@ -192,17 +224,22 @@ class SequenceDataset(torch.utils.data.Dataset):
         
         self.n_demos = len(self.demos)
         
-        # keep internal index maps to know which transitions belong to which demos
-        self._index_to_demo_id = dict()  # maps every index to a demo id
+        # keep internal index maps to know which transitions belong to which demos. Sequence
+        # indices are resolved by binary search over the per-demo start indices, so the maps
+        # only grow with the number of demos rather than the number of sequences.
         self._demo_id_to_start_indices = dict()  # gives start index per demo id
         self._demo_id_to_demo_length = dict()
+        self._demo_lengths = np.zeros(self.n_demos, dtype=np.int64)
+        self._demo_start_indices = np.zeros(self.n_demos, dtype=np.int64)
 
         # determine index mapping
         self.total_num_sequences = 0
-        for ep in self.demos:
-            demo_length = self.hdf5_file["data/{}".format(ep)].attrs["num_samples"]
+        for i, ep in enumerate(self.demos):
+            demo_length = self.dataset_index["demo_lengths"][ep]
             self._demo_id_to_start_indices[ep] = self.total_num_sequences
             self._demo_id_to_demo_length[ep] = demo_length
+            self._demo_lengths[i] = demo_length
+            self._demo_start_indices[i] = self.total_num_sequences
 
             num_sequences = demo_length
             # determine actual number of sequences taking into account whether to pad for frame_stack and seq_length
@@ -217,9 +254,7 @@ class SequenceDataset(torch.utils.data.Dataset):
             else:
                 assert num_sequences >= 1  # assume demo_length >= (self.n_frame_stack - 1 + self.seq_length)
 
-            for _ in range(num_sequences):
-                self._index_to_demo_id[self.total_num_sequences] = ep
-                self.total_num_sequences += 1
+            self.total_num_sequences += num_sequences
 
     @property
     def hdf5_file(self):
@@ -278,9 +313,11 @@ class SequenceDataset(torch.utils.data.Dataset):
 
     def load_dataset_in_memory(self, demo_list, hdf5_file, obs_keys, dataset_keys, load_next_obs):
         """
-        Loads the hdf5 dataset into memory, preserving the structure of the file. Note that this
-        differs from `self.getitem_cache`, which, if active, actually caches the outputs of the
-        `getitem` operation.
+        Loads the hdf5 dataset into memory. Every key is stored as a single contiguous array in
+        which the demos are concatenated, each one padded at the beginning and end by repeating
+        its first and last entries. Sequences can then be returned as views into these arrays
+        rather than padded copies (see @get_cached_sequence). uint8 keys (images) keep their
+        dtype, everything else is cast to float32.
 
         Args:
             demo_list (list): list of demo keys, e.g., 'demo_0'
@@ -290,30 +327,104 @@ class SequenceDataset(torch.utils.data.Dataset):
             load_next_obs (bool): whether to load next_obs from the dataset
 
         Returns:
-            all_data (dict): dictionary of loaded data.
+            all_data (dict): dictionary mapping keys (e.g. 'actions', 'obs/agentview_rgb') to
+                padded, concatenated arrays.
         """
+        # enough padding for every sequence fetched by get_item to be a slice of the cache
+        lowdim_obs_seq_length = self.lowdim_obs_seq_length if self.lowdim_obs_seq_length is not None else 1
+        begin_pad = self.n_frame_stack
+        end_pad = max(self.seq_length, self.obs_seq_length, lowdim_obs_seq_length) - 1
+        self._cache_padding = (begin_pad, end_pad)
+
+        self._cache_demo_starts = dict()
+        total_length = 0
+        for ep in demo_list:
+            self._cache_demo_starts[ep] = total_length
+            total_length += self._demo_id_to_demo_length[ep] + begin_pad + end_pad
+
+        keys = ["obs/{}".format(k) for k in obs_keys] + list(dataset_keys)
         all_data = dict()
-        # print("SequenceDataset: loading dataset into memory...")
-        for ep in tqdm(demo_list, disable=True):
-            all_data[ep] = {}
-            all_data[ep]["attrs"] = {}
-            all_data[ep]["attrs"]["num_samples"] = hdf5_file["data/{}".format(ep)].attrs["num_samples"]
-            # get obs
-            all_data[ep]["obs"] = {k: hdf5_file["data/{}/obs/{}".format(ep, k)][()].astype('float32') for k in obs_keys}
-            # if load_next_obs:
-            #     all_data[ep]["next_obs"] = {k: hdf5_file["data/{}/next_obs/{}".format(ep, k)][()].astype('float32') for k in obs_keys}
-            # get other dataset keys
-            for k in dataset_keys:
+        for k in keys:
+            all_data[k] = None
+            for ep in tqdm(demo_list, disable=True):
+                demo_length = self._demo_id_to_demo_length[ep]
                 if k in hdf5_file["data/{}".format(ep)]:
-                    all_data[ep][k] = hdf5_file["data/{}/{}".format(ep, k)][()].astype('float32')
+                    data = hdf5_file["data/{}/{}".format(ep, k)][()]
+                    # images stay uint8 and are converted to float on device by the policy
+                    if data.dtype != np.uint8:
+                        data = data.astype('float32')
                 else:
-                    all_data[ep][k] = np.zeros((all_data[ep]["attrs"]["num_samples"], 1), dtype=np.float32)
-
-            if "model_file" in hdf5_file["data/{}".format(ep)].attrs:
-                all_data[ep]["attrs"]["model_file"] = hdf5_file["data/{}".format(ep)].attrs["model_file"]
+                    data = np.zeros((demo_length, 1), dtype=np.float32)
+                if all_data[k] is None:
+                    all_data[k] = np.empty((total_length, *data.shape[1:]), dtype=data.dtype)
+                start = self._cache_demo_starts[ep] + begin_pad
+                end = start + demo_length
+                all_data[k][start - begin_pad:start] = data[0]
+                all_data[k][start:end] = data
+                all_data[k][end:end + end_pad] = data[-1]
+
+        # first unpadded row of every demo in the cache, for batched gathers
+        self._cache_demo_offsets = np.array(
+            [self._cache_demo_starts[ep] + begin_pad for ep in demo_list], dtype=np.int64)
 
         return all_data
 
+    def load_dataset_mmap(self, demo_list, dataset_keys):
+        """
+        Use the memory-mapped columnar copy of the dataset as the cache. Demos are stored
+        without padding, so sequences at the boundaries of a demo are gathered with clamped
+        indices, while all others are views into the memory maps.
+
+        Args:
+            demo_list (list): list of demo keys, e.g., 'demo_0'
+            dataset_keys (list, tuple): dataset keys to fetch, e.g., 'actions'
+
+        Returns:
+            columnar (ColumnarDataset): reader for the columnar copy
+        """
+        self._cache_padding = (0, 0)
+        self._cache_demo_starts = {ep: self.columnar.demo_offsets[ep] for ep in demo_list}
+        self._cache_demo_offsets = np.array([self._cache_demo_starts[ep] for ep in demo_list], dtype=np.int64)
+
+        for k in dataset_keys:
+            if k not in self.columnar:
+                self.columnar.add_column(k, np.zeros((self.columnar.num_samples, 1), dtype=np.float32))
+        return self.columnar
+
+    def share_memory(self):
+        """
+        Move the in-memory cache into a single shared memory block. Only the name and layout of
+        the block are pickled when the dataset is sent to DataLoader workers (e.g. with the spawn
+        context or persistent workers), and with fork the workers never touch pages that python
+        reference counting writes to, so the cache is not duplicated per worker.
+        """
+        if self.hdf5_cache is not None and not isinstance(self.hdf5_cache, SharedArrayDict):
+            self.hdf5_cache = SharedArrayDict(self.hdf5_cache)
+
+    def key_is_in_memory(self, key):
+        """
+        Whether dataset key @key (e.g. 'actions' or 'obs/agentview_rgb') is cached in memory.
+        """
+        if self.hdf5_cache is None:
+            return False
+        return key in self.hdf5_cache
+
+    def get_cached_sequence(self, ep, key, begin_index, length):
+        """
+        Fetch @length entries of cached key @key starting at @begin_index in demo @ep, where
+        out-of-range indices are clamped to the first / last entry of the demo. Returns a view
+        into the cache whenever the sequence lies within the padded demo.
+        """
+        data = self.hdf5_cache[key]
+        demo_length = self._demo_id_to_demo_length[ep]
+        begin_pad, end_pad = self._cache_padding
+        start = self._cache_demo_starts[ep] + begin_pad
+
+        if begin_index >= -begin_pad and begin_index + length <= demo_length + end_pad:
+            return data[start + begin_index: start + begin_index + length]
+        inds = np.clip(np.arange(begin_index, begin_index + length), 0, demo_length - 1)
+        return data[start + inds]
+
     def normalize_obs(self):
         """
         Computes a dataset-wide mean and standard deviation for the observations 
@@ -386,51 +497,93 @@ class SequenceDataset(torch.utils.data.Dataset):
         Helper utility to get a dataset for a specific demonstration.
         Takes into account whether the dataset has been loaded into memory.
         """
-
-        # check if this key should be in memory
-        key_should_be_in_memory = (self.hdf5_cache_mode in ["all", "low_dim"])
-        if key_should_be_in_memory:
-            # if key is an observation, it may not be in memory
-            if '/' in key:
-                key1, key2 = key.split('/')
-                assert(key1 in ['obs', 'next_obs'])
-                if key2 not in self.obs_keys_in_memory:
-                    key_should_be_in_memory = False
-
-        if key_should_be_in_memory:
+        if self.key_is_in_memory(key):
             # read cache
-            if '/' in key:
-                key1, key2 = key.split('/')
-                assert(key1 in ['obs', 'next_obs'])
-                ret = self.hdf5_cache[ep][key1][key2]
-            else:
-                ret = self.hdf5_cache[ep][key]
-        else:
-            # read from file
-            hd5key = "data/{}/{}".format(ep, key)
-            ret = self.hdf5_file[hd5key]
-        return ret
+            return self.get_cached_sequence(ep, key, 0, self._demo_id_to_demo_length[ep])
+        # read from file
+        hd5key = "data/{}/{}".format(ep, key)
+        return self.hdf5_file[hd5key]
 
     def __getitem__(self, index):
         """
-        Fetch dataset sequence @index (inferred through internal index map), using the getitem_cache if available.
+        Fetch dataset sequence @index (inferred through internal index map).
         """
-        if self.hdf5_cache_mode == "all":
-            return self.getitem_cache[index]
-        return self.get_item(index)
+        meta = self.get_item(index)
+        if len(self.precomputed) > 0:
+            for k, v in self.precomputed.items():
+                meta[k] = v[index]
+        return meta
 
-    def get_item(self, index):
+    def add_precomputed(self, key, array):
         """
-        Main implementation of getitem when not using cache.
+        Attach an array with one entry per sequence in the dataset. Entry @index of @array is
+        returned under @key by every subsequent call to __getitem__(@index).
+
+        Args:
+            key (str): key under which the entries are returned
+            array (np.ndarray): array of shape [len(self), ...]
         """
+        assert len(array) == len(self), \
+            f"expected {len(self)} precomputed entries for {key}, got {len(array)}"
+        self.precomputed[key] = array
 
-        demo_id = self._index_to_demo_id[index]
-        demo_start_index = self._demo_id_to_start_indices[demo_id]
-        demo_length = self._demo_id_to_demo_length[demo_id]
+    def resolve_indices(self, indices):
+        """
+        Resolve an array of dataset sequence indices to the demos they belong to.
+
+        Args:
+            indices (np.ndarray or list): dataset sequence indices
+
+        Returns:
+            demo_indices (np.ndarray): index of each sequence's demo in @self.demos
+            index_in_demo (np.ndarray): start index of each sequence within its demo
+            demo_lengths (np.ndarray): length of each sequence's demo
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size > 0 and (indices.min() < 0 or indices.max() >= self.total_num_sequences):
+            raise IndexError("sequence index out of range for dataset of length {}".format(self.total_num_sequences))
+        demo_indices = np.searchsorted(self._demo_start_indices, indices, side="right") - 1
 
         # start at offset index if not padding for frame stacking
         demo_index_offset = 0 if self.pad_frame_stack else (self.n_frame_stack - 1)
-        index_in_demo = index - demo_start_index + demo_index_offset
+        index_in_demo = indices - self._demo_start_indices[demo_indices] + demo_index_offset
+        return demo_indices, index_in_demo, self._demo_lengths[demo_indices]
+
+    def get_index_in_demo(self, index):
+        """
+        Resolve dataset sequence @index to its demo id, its start index within that demo and
+        the demo length.
+        """
+        demo_indices, index_in_demo, demo_lengths = self.resolve_indices([index])
+        return self.demos[demo_indices[0]], int(index_in_demo[0]), int(demo_lengths[0])
+
+    def get_dataset_items(self, indices, keys=None):
+        """
+        Fetch only the dataset items (e.g. actions) of sequences @indices, skipping observations.
+        Useful for passes over the dataset that don't need images.
+
+        Args:
+            indices (list or np.ndarray): dataset sequence indices
+            keys (tuple): dataset keys to fetch. Defaults to all dataset keys.
+
+        Returns:
+            a dictionary of extracted items with a leading batch dimension.
+        """
+        keys = self.dataset_keys if keys is None else tuple(keys)
+        demo_indices, index_in_demo, _ = self.resolve_indices(indices)
+        return self.get_dataset_sequences(
+            demo_indices,
+            index_in_demo=index_in_demo,
+            keys=keys,
+            seq_length=self.seq_length
+        )
+
+    def get_item(self, index):
+        """
+        Main implementation of getitem when not using cache.
+        """
+
+        demo_id, index_in_demo, demo_length = self.get_index_in_demo(index)
 
         # end at offset index if not padding for seq length
         demo_length_offset = 0 if self.pad_seq_length else (self.seq_length - 1)
@@ -531,6 +684,192 @@ class SequenceDataset(torch.utils.data.Dataset):
 
         return meta
 
+    def __getitems__(self, indices):
+        """
+        Fetch a batch of dataset sequences @indices at once. Called by torch DataLoader instead
+        of __getitem__ for every index in a batch, and returns the already collated batch, so the
+        DataLoader should use @collate_batch (see @get_items).
+        """
+        batch = self.get_items(indices)
+        for k, v in self.precomputed.items():
+            batch[k] = v[indices]
+        return TensorUtils.to_tensor(TensorUtils.map_ndarray(batch, np.ascontiguousarray))
+
+    def get_items(self, indices):
+        """
+        Batched version of @get_item. Cached keys are gathered for the whole batch with a single
+        fancy index per key, while keys that are read from file fall back to per-sample reads.
+
+        Args:
+            indices (list or np.ndarray): dataset sequence indices
+
+        Returns:
+            meta (dict): same structure as the output of @get_item, where every array has an
+                additional leading batch dimension.
+        """
+        demo_indices, index_in_demo, demo_lengths = self.resolve_indices(indices)
+
+        # end at offset index if not padding for seq length
+        demo_length_offset = 0 if self.pad_seq_length else (self.seq_length - 1)
+        end_index_in_demo = demo_lengths - demo_length_offset
+
+        meta = self.get_dataset_sequences(
+            demo_indices,
+            index_in_demo=index_in_demo,
+            keys=self.dataset_keys,
+            seq_length=self.seq_length
+        )
+
+        if self.lowdim_obs_seq_length is None:
+            meta["obs"] = self.get_obs_sequences(
+                demo_indices,
+                index_in_demo=index_in_demo,
+                keys=self.obs_keys,
+                num_frames_to_stack=self.n_frame_stack - 1,
+                seq_length=self.obs_seq_length,
+                prefix="obs"
+            )
+        else:
+            high_dim_keys = [key for key in self.obs_keys if not ObsUtils.key_is_obs_modality(key, "low_dim")]
+            low_dim_keys = [key for key in self.obs_keys if ObsUtils.key_is_obs_modality(key, "low_dim")]
+
+            meta["obs"] = self.get_obs_sequences(
+                demo_indices,
+                index_in_demo=index_in_demo,
+                keys=high_dim_keys,
+                num_frames_to_stack=self.n_frame_stack - 1,
+                seq_length=self.obs_seq_length,
+                prefix="obs"
+            )
+            meta["obs"].update(self.get_obs_sequences(
+                demo_indices,
+                index_in_demo=index_in_demo,
+                keys=low_dim_keys,
+                num_frames_to_stack=self.n_frame_stack,
+                seq_length=self.lowdim_obs_seq_length,
+                prefix="obs"
+            ))
+
+        if self.hdf5_normalize_obs:
+            meta["obs"] = ObsUtils.normalize_obs(meta["obs"], obs_normalization_stats=self.obs_normalization_stats)
+
+        if self.load_next_obs:
+            # next obs is the observation after the sequence, see @get_item
+            next_obs_start = np.minimum(index_in_demo + self.seq_length, demo_lengths - 1)
+            meta["next_obs"] = self.get_obs_sequences(
+                demo_indices,
+                index_in_demo=next_obs_start,
+                keys=self.obs_keys,
+                num_frames_to_stack=self.n_frame_stack - 1,
+                seq_length=1,
+                prefix="obs"
+            )
+
+            if self.hdf5_normalize_obs:
+                meta["next_obs"] = ObsUtils.normalize_obs(meta["next_obs"], obs_normalization_stats=self.obs_normalization_stats)
+
+        if self.goal_mode == "last":
+            goal = self.get_obs_sequences(
+                demo_indices,
+                index_in_demo=end_index_in_demo - 1,
+                keys=self.obs_keys,
+                num_frames_to_stack=0,
+                seq_length=1,
+                prefix="next_obs",
+            )
+            if self.hdf5_normalize_obs:
+                goal = ObsUtils.normalize_obs(goal, obs_normalization_stats=self.obs_normalization_stats)
+            meta["goal_obs"] = {k: goal[k][:, 0] for k in goal}  # remove sequence dimension for goal
+
+        return meta
+
+    def get_sequences(self, demo_indices, index_in_demo, keys, num_frames_to_stack=0, seq_length=1):
+        """
+        Batched version of @get_sequence_from_demo.
+
+        Args:
+            demo_indices (np.ndarray): index of the demo of every sequence in @self.demos
+            index_in_demo (np.ndarray): beginning index of every sequence wrt its demo
+            keys (tuple): list of keys to extract
+            num_frames_to_stack (int): numbers of frame to stack. Seq gets prepended with repeated items if out of range
+            seq_length (int): sequence length to extract. Seq gets post-pended with repeated items if out of range
+
+        Returns:
+            a dictionary of extracted items of shape [B, num_frames_to_stack + seq_length, ...]
+                and the padding mask of shape [B, num_frames_to_stack + seq_length, 1].
+        """
+        assert num_frames_to_stack >= 0
+        assert seq_length >= 1
+
+        demo_lengths = self._demo_lengths[demo_indices]
+        assert np.all(index_in_demo < demo_lengths)
+
+        # index of every sequence element wrt its demo, before padding
+        steps = index_in_demo[:, None] + np.arange(-num_frames_to_stack, seq_length)[None]
+        pad_mask = (steps >= 0) & (steps < demo_lengths[:, None])
+
+        # make sure we are not padding if specified.
+        if not self.pad_frame_stack:
+            assert np.all(steps[:, 0] >= 0)
+        if not self.pad_seq_length:
+            assert np.all(steps[:, -1] < demo_lengths)
+
+        seq = dict()
+        cached_keys = [k for k in keys if self.key_is_in_memory(k)]
+        file_keys = tuple(k for k in keys if not self.key_is_in_memory(k))
+        if len(cached_keys) > 0:
+            rows = self._cache_demo_offsets[demo_indices][:, None] + np.clip(steps, 0, demo_lengths[:, None] - 1)
+            for k in cached_keys:
+                seq[k] = self.hdf5_cache[k][rows]
+        if len(file_keys) > 0:
+            file_seqs = [
+                self.get_sequence_from_demo(
+                    self.demos[demo_index],
+                    index_in_demo=int(index),
+                    keys=file_keys,
+                    num_frames_to_stack=num_frames_to_stack,
+                    seq_length=seq_length
+                )[0]
+                for demo_index, index in zip(demo_indices, index_in_demo)
+            ]
+            for k in file_keys:
+                seq[k] = np.stack([file_seq[k] for file_seq in file_seqs])
+
+        return seq, pad_mask[..., None]
+
+    def get_obs_sequences(self, demo_indices, index_in_demo, keys, num_frames_to_stack=0, seq_length=1, prefix="obs"):
+        """
+        Batched version of @get_obs_sequence_from_demo.
+        """
+        obs, pad_mask = self.get_sequences(
+            demo_indices,
+            index_in_demo=index_in_demo,
+            keys=tuple('{}/{}'.format(prefix, k) for k in keys),
+            num_frames_to_stack=num_frames_to_stack,
+            seq_length=seq_length,
+        )
+        obs = {k.split('/')[1]: obs[k] for k in obs}  # strip the prefix
+        if self.get_pad_mask:
+            obs["pad_mask"] = pad_mask
+
+        # prepare image observations from dataset
+        return ObsUtils.process_obs_dict(obs)
+
+    def get_dataset_sequences(self, demo_indices, index_in_demo, keys, seq_length=1):
+        """
+        Batched version of @get_dataset_sequence_from_demo.
+        """
+        data, pad_mask = self.get_sequences(
+            demo_indices,
+            index_in_demo=index_in_demo,
+            keys=keys,
+            num_frames_to_stack=0,  # don't frame stack for meta keys
+            seq_length=seq_length,
+        )
+        if self.get_pad_mask:
+            data["pad_mask"] = pad_mask
+        return data
+
     def get_sequence_from_demo(self, demo_id, index_in_demo, keys, num_frames_to_stack=0, seq_length=1):
         """
         Extract a (sub)sequence of data items from a demo given the @keys of the items.
@@ -565,13 +904,19 @@ class SequenceDataset(torch.utils.data.Dataset):
         if not self.pad_seq_length:
             assert seq_end_pad == 0
 
-        # fetch observation from the dataset file
+        # fetch cached keys as views into memory and the remaining ones from the dataset file
         seq = dict()
+        file_seq = dict()
         for k in keys:
-            data = self.get_dataset_for_ep(demo_id, k)
-            seq[k] = data[seq_begin_index: seq_end_index]
+            if self.key_is_in_memory(k):
+                seq[k] = self.get_cached_sequence(
+                    demo_id, k, index_in_demo - num_frames_to_stack, num_frames_to_stack + seq_length)
+            else:
+                data = self.get_dataset_for_ep(demo_id, k)
+                file_seq[k] = data[seq_begin_index: seq_end_index]
 
-        seq = TensorUtils.pad_sequence(seq, padding=(seq_begin_pad, seq_end_pad), pad_same=True)
+        file_seq = TensorUtils.pad_sequence(file_seq, padding=(seq_begin_pad, seq_end_pad), pad_same=True)
+        seq.update(file_seq)
         pad_mask = np.array([0] * seq_begin_pad + [1] * (seq_end_index - seq_begin_index) + [0] * seq_end_pad)
         pad_mask = pad_mask[:, None].astype(bool)
 
@@ -671,3 +1016,309 @@ class SequenceDataset(torch.utils.data.Dataset):
         `DataLoader` documentation, for more info.
         """
         return None
+
+
+def get_sequence_datasets(dataset):
+    """
+    Returns the list of SequenceDataset instances wrapped by @dataset, which can be a
+    SequenceDataset, a wrapper exposing @sequence_dataset (e.g. SequenceVLDataset) or
+    a torch ConcatDataset of those.
+    """
+    if isinstance(dataset, SequenceDataset):
+        return [dataset]
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        return [ds for d in dataset.datasets for ds in get_sequence_datasets(d)]
+    if hasattr(dataset, 'sequence_dataset'):
+        return get_sequence_datasets(dataset.sequence_dataset)
+    raise ValueError(f'cannot find a SequenceDataset in {type(dataset)}')
+
+
+def _timed_build(build_fn, kwargs):
+    start = time.perf_counter()
+    dataset = build_fn(**kwargs)
+    return dataset, time.perf_counter() - start
+
+
+def build_datasets(build_fn, kwargs_list, num_workers=1, executor="thread", names=None, verbose=True):
+    """
+    Build one dataset per entry of @kwargs_list with @build_fn, running up to @num_workers
+    builds concurrently, and report how long each one took.
+
+    With the "thread" executor, builds share the process and h5py serializes file access,
+    so this mostly overlaps file system latency. The "process" executor forks workers that
+    read and decompress files in parallel, and sends the built datasets back to this process,
+    so it suits datasets whose cache is built in memory. Since in-memory caches are pickled
+    back, a shared memory cache should only be created afterwards (see
+    @SequenceDataset.share_memory).
+
+    Args:
+        build_fn (function): function building a dataset from keyword arguments. Must be
+            picklable for the "process" executor.
+        kwargs_list (list): keyword arguments for every dataset
+        num_workers (int): maximum number of concurrent builds, which bounds concurrent file i/o
+        executor (str): one of ["thread", "process"]
+        names (list): names of the datasets in the timing report. Defaults to their index.
+        verbose (bool): if True, print the timing report
+
+    Returns:
+        datasets (list): built datasets, in the order of @kwargs_list
+    """
+    assert executor in ["thread", "process"]
+    start = time.perf_counter()
+    build_fns = [build_fn] * len(kwargs_list)
+    if num_workers <= 1 or len(kwargs_list) <= 1:
+        results = list(map(_timed_build, build_fns, kwargs_list))
+    else:
+        num_workers = min(num_workers, len(kwargs_list))
+        if executor == "process":
+            # fork so that workers inherit global state such as the observation modalities
+            pool = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("fork"))
+        else:
+            pool = ThreadPoolExecutor(max_workers=num_workers)
+        with pool:
+            results = list(pool.map(_timed_build, build_fns, kwargs_list))
+
+    datasets = [dataset for dataset, _ in results]
+    if verbose:
+        names = [str(i) for i in range(len(kwargs_list))] if names is None else names
+        width = max(len(name) for name in names)
+        print("\n===================  Dataset Build Times  ===================")
+        for name, (_, build_time) in zip(names, results):
+            print(" {}  {:7.2f}s".format(name.ljust(width), build_time))
+        print(" Total: {:.2f}s with {} {} worker(s)".format(
+            time.perf_counter() - start, max(1, min(num_workers, len(kwargs_list))), executor))
+    return datasets
+
+
+class BatchedConcatDataset(torch.utils.data.ConcatDataset):
+    """
+    ConcatDataset that forwards batched fetches to the __getitems__ of its datasets, splitting
+    the batch by dataset and restoring the original order of the samples afterwards.
+    """
+    def __getitems__(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices < 0, indices + len(self), indices)
+        dataset_indices = np.searchsorted(self.cumulative_sizes, indices, side="right")
+
+        batches, positions = [], []
+        for dataset_index in np.unique(dataset_indices):
+            dataset = self.datasets[dataset_index]
+            dataset_positions = np.nonzero(dataset_indices == dataset_index)[0]
+            sample_indices = indices[dataset_positions]
+            if dataset_index > 0:
+                sample_indices = sample_indices - self.cumulative_sizes[dataset_index - 1]
+            if hasattr(dataset, "__getitems__"):
+                batches.append(dataset.__getitems__(sample_indices.tolist()))
+            else:
+                batches.append(torch.utils.data.default_collate([dataset[i] for i in sample_indices]))
+            positions.append(dataset_positions)
+
+        if len(batches) == 1:
+            return batches[0]
+        order = torch.from_numpy(np.argsort(np.concatenate(positions)))
+        return TensorUtils.map_tensor(_cat_batches(batches), lambda x: x[order])
+
+
+def _cat_batches(batches):
+    """
+    Concatenate a list of collated (nested dict) batches along the batch dimension.
+    """
+    if isinstance(batches[0], dict):
+        return {k: _cat_batches([b[k] for b in batches]) for k in batches[0]}
+    return torch.cat(batches, dim=0)
+
+
+def collate_batch(batch):
+    """
+    Collate function for DataLoaders over datasets implementing __getitems__, which return
+    batches that are already collated. Falls back to the default collate function otherwise.
+    """
+    if isinstance(batch, dict):
+        return batch
+    return torch.utils.data.default_collate(batch)
+
+
+class ResumableRandomSampler(torch.utils.data.Sampler):
+    """
+    Sampler visiting the dataset in a permutation that only depends on @seed and the epoch, so
+    that a run resumed from the middle of an epoch can skip the sequences it already consumed
+    without iterating over them.
+
+    For distributed training, every rank builds the same permutation, padded by wrapping around
+    to a multiple of @num_replicas samples, and takes every @num_replicas-th of its remaining
+    samples starting at its @rank, so that all ranks get the same number of samples. The
+    position in the epoch is counted in samples of the whole permutation, so a run can be resumed
+    with a different number of processes.
+
+    Args:
+        data_source: dataset to sample from
+        shuffle (bool): if False, visit the dataset in order
+        seed (int): seed of the permutations
+        num_replicas (int): number of processes sharing the dataset
+        rank (int): rank of this process
+    """
+    def __init__(self, data_source, shuffle=True, seed=0, num_replicas=1, rank=0):
+        assert 0 <= rank < num_replicas
+        self.num_samples = len(data_source)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start_index = 0
+
+    @property
+    def total_size(self):
+        # size of the padded permutation
+        return (self.num_samples + self.num_replicas - 1) // self.num_replicas * self.num_replicas
+
+    def set_epoch(self, epoch, start_index=0):
+        """
+        Select the permutation of @epoch and skip its first @start_index samples.
+        """
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def get_indices(self):
+        """
+        Returns the remaining indices of the current epoch for this rank as a long tensor.
+        """
+        if not self.shuffle:
+            indices = torch.arange(self.num_samples)
+        else:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(self.num_samples, generator=generator)
+        if self.num_replicas == 1:
+            return indices[self.start_index:]
+        indices = _pad_by_wrapping(indices, self.total_size)[self.start_index:]
+        # a run resumed with a different number of processes may need more padding
+        indices = _pad_by_wrapping(indices, len(self) * self.num_replicas)
+        return indices[self.rank::self.num_replicas]
+
+    def __iter__(self):
+        return iter(self.get_indices().tolist())
+
+    def __len__(self):
+        if self.start_index >= self.num_samples:
+            return 0
+        num_remaining = self.total_size - self.start_index
+        return (num_remaining + self.num_replicas - 1) // self.num_replicas
+
+    def state_dict(self, num_consumed=0, batch_size=1, drop_last=False):
+        """
+        State of the sampler after every rank consumed @num_consumed more samples of the
+        current epoch. If that leaves no batch of @batch_size samples for the data loader, it
+        is the state at the start of the next epoch.
+        """
+        start_index = min(self.start_index + num_consumed * self.num_replicas, self.total_size)
+        num_remaining = (self.total_size - start_index + self.num_replicas - 1) // self.num_replicas
+        if num_remaining == 0 or (drop_last and num_remaining < batch_size):
+            return {"seed": self.seed, "epoch": self.epoch + 1, "start_index": 0}
+        return {
+            "seed": self.seed,
+            "epoch": self.epoch,
+            "start_index": start_index,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict["seed"]
+        self.set_epoch(state_dict["epoch"], state_dict["start_index"])
+
+
+def _pad_by_wrapping(indices, size):
+    if len(indices) >= size:
+        return indices
+    return indices.repeat(size // len(indices) + 1)[:size]
+
+
+class ActionChunkDataset(object):
+    """
+    Iterable over random batches of action windows, for autoencoder pretraining which only needs
+    the actions of every sequence. The actions of all demos are padded at the end the way
+    SequenceDataset pads sequences and concatenated into a single tensor kept on @device, and
+    every sequence of the wrapped datasets is a window of a strided view of that tensor. A batch
+    is a single gather on @device, so it doesn't go through __getitem__, DataLoader workers or
+    collation.
+
+    Args:
+        dataset: dataset wrapping one or more SequenceDatasets (see @get_sequence_datasets)
+        batch_size (int): number of windows per batch
+        device (str): device holding the actions and the batches
+        shuffle (bool): if True, visit the windows in a new random order every epoch
+        drop_last (bool): if True, drop the last batch of an epoch if it is incomplete
+        key (str): dataset key of the actions
+        sampler (ResumableRandomSampler): if not None, the order of the windows in every epoch
+            is taken from @sampler instead of @shuffle
+    """
+    def __init__(self, dataset, batch_size, device="cpu", shuffle=True, drop_last=False, key="actions", sampler=None):
+        self.batch_size = batch_size
+        self.device = device
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.key = key
+        self.sampler = sampler
+
+        sequence_datasets = get_sequence_datasets(dataset)
+        self.seq_length = sequence_datasets[0].seq_length
+        chunks, window_starts = [], []
+        num_steps = 0
+        for sequence_dataset in sequence_datasets:
+            assert sequence_dataset.seq_length == self.seq_length, \
+                "all datasets must have the same sequence length"
+            demo_starts = []
+            for ep in sequence_dataset.demos:
+                actions = np.asarray(sequence_dataset.get_dataset_for_ep(ep, key), dtype=np.float32)
+                # repeat the last action so that windows starting near the end are padded
+                actions = np.concatenate([actions, np.repeat(actions[-1:], self.seq_length - 1, axis=0)])
+                chunks.append(actions)
+                demo_starts.append(num_steps)
+                num_steps += len(actions)
+            demo_indices, index_in_demo, _ = sequence_dataset.resolve_indices(np.arange(len(sequence_dataset)))
+            window_starts.append(np.asarray(demo_starts, dtype=np.int64)[demo_indices] + index_in_demo)
+
+        self.actions = torch.from_numpy(np.concatenate(chunks)).contiguous().to(device)
+        self.window_starts = torch.from_numpy(np.concatenate(window_starts)).to(device)
+
+        # [num_steps - seq_length + 1, seq_length, action_dim] view, window i starts at step i
+        action_dim = self.actions.shape[1]
+        self.windows = self.actions.as_strided(
+            (len(self.actions) - self.seq_length + 1, self.seq_length, action_dim),
+            (action_dim, action_dim, 1)
+        )
+
+    @property
+    def num_windows(self):
+        return len(self.window_starts)
+
+    def __len__(self):
+        """
+        Number of batches per epoch.
+        """
+        num_windows = self.num_windows if self.sampler is None else len(self.sampler)
+        if self.drop_last:
+            return num_windows // self.batch_size
+        return (num_windows + self.batch_size - 1) // self.batch_size
+
+    def get_batch(self, indices):
+        """
+        Returns the batch made of windows @indices (a long tensor on @self.device).
+        """
+        return {self.key: self.windows[self.window_starts[indices]]}
+
+    def sample(self, batch_size=None):
+        """
+        Returns a batch of windows drawn uniformly at random with replacement.
+        """
+        batch_size = self.batch_size if batch_size is None else batch_size
+        return self.get_batch(torch.randint(self.num_windows, (batch_size,), device=self.device))
+
+    def __iter__(self):
+        if self.sampler is not None:
+            order = self.sampler.get_indices().to(self.device)
+        elif self.shuffle:
+            order = torch.randperm(self.num_windows, device=self.device)
+        else:
+            order = torch.arange(self.num_windows, device=self.device)
+        for i in range(len(self)):
+            yield self.get_batch(order[i * self.batch_size: (i + 1) * self.batch_size])
@@ -0,0 +1,150 @@
+"""
+Helpers for data-parallel training with torch.distributed. train.py is launched once per process
+with torchrun, which sets the RANK, WORLD_SIZE and LOCAL_RANK environment variables, e.g.
+
+    torchrun --nnodes 2 --nproc_per_node 4 --rdzv_backend c10d --rdzv_endpoint $HOST:29500 \
+        train.py --config-name=train_prior ...
+
+Policies are trained through compute_loss rather than forward, so they are not wrapped in
+DistributedDataParallel. Instead, the weights are broadcast from rank 0 once and gradients are
+averaged with @all_reduce_gradients after every backward pass.
+"""
+import datetime
+import os
+
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+from quest.algos.baseline_modules.act_utils.misc import (
+    get_rank,
+    get_world_size,
+    is_dist_avail_and_initialized,
+    is_main_process,
+    setup_for_distributed,
+)
+
+
+def init_distributed(backend="gloo", timeout_minutes=30):
+    """
+    Join the process group described by the environment variables set by torchrun. Does nothing
+    if the script was not launched by torchrun or with a single process. Printing is disabled in
+    every process except rank 0, unless print is called with force=True. On machines with gpus,
+    the current device is set to cuda:<local rank>.
+
+    Args:
+        backend (str): process group backend. gloo also runs on machines without gpus
+        timeout_minutes (float): timeout of collectives. Other ranks wait for rank 0 while it
+            runs rollouts and writes checkpoints, so this should be longer than a rollout
+
+    Returns:
+        rank (int): rank of this process
+        world_size (int): number of processes
+        local_rank (int): rank of this process on its node
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size <= 1:
+        return 0, 1, 0
+    rank = int(os.environ["RANK"])
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if torch.cuda.is_available():
+        # nccl runs collectives, including the object collectives, on the current device,
+        # which would otherwise be cuda:0 for every rank
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group(
+        backend=backend,
+        rank=rank,
+        world_size=world_size,
+        timeout=datetime.timedelta(minutes=timeout_minutes),
+    )
+    setup_for_distributed(rank == 0)
+    print(f"| distributed init (rank {rank} of {world_size}, backend {backend})", force=True)
+    return rank, world_size, local_rank
+
+
+def cleanup():
+    if is_dist_avail_and_initialized():
+        dist.destroy_process_group()
+
+
+def barrier():
+    if is_dist_avail_and_initialized():
+        dist.barrier()
+
+
+def broadcast_object(obj, src=0):
+    """
+    Returns @obj of rank @src on every rank. @obj must be picklable.
+    """
+    if not is_dist_avail_and_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def all_gather_object(obj):
+    """
+    Returns the list of @obj of every rank, ordered by rank.
+    """
+    if not is_dist_avail_and_initialized():
+        return [obj]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
+
+
+@torch.no_grad()
+def broadcast_parameters(module, src=0):
+    """
+    Copy the parameters and buffers of @module on rank @src to every other rank.
+    """
+    if not is_dist_avail_and_initialized():
+        return
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        dist.broadcast(tensor.data, src=src)
+
+
+def _buckets(tensors, bucket_size):
+    # group tensors of the same dtype and device into buckets of about @bucket_size bytes
+    buckets, current, current_size = [], {}, {}
+    for tensor in tensors:
+        key = (tensor.dtype, tensor.device)
+        current.setdefault(key, []).append(tensor)
+        current_size[key] = current_size.get(key, 0) + tensor.numel() * tensor.element_size()
+        if current_size[key] >= bucket_size:
+            buckets.append(current.pop(key))
+            current_size[key] = 0
+    buckets.extend(current.values())
+    return buckets
+
+
+@torch.no_grad()
+def all_reduce_gradients(module, bucket_size_mb=25):
+    """
+    Average the gradients of @module over all ranks in place. Gradients are flattened into
+    buckets of about @bucket_size_mb megabytes so that there is one collective per bucket
+    rather than per parameter. Parameters without a gradient are skipped, which assumes that
+    every rank leaves the same parameters unused.
+    """
+    world_size = get_world_size()
+    if world_size == 1:
+        return
+    grads = [p.grad for p in module.parameters() if p.grad is not None]
+    for bucket in _buckets(grads, bucket_size_mb * 1024 * 1024):
+        flat = _flatten_dense_tensors(bucket)
+        dist.all_reduce(flat)
+        flat.div_(world_size)
+        for grad, reduced in zip(bucket, _unflatten_dense_tensors(flat, bucket)):
+            grad.copy_(reduced)
+
+
+def all_reduce_mean(tensor):
+    """
+    Returns the mean of @tensor over all ranks.
+    """
+    if get_world_size() == 1:
+        return tensor
+    tensor = tensor.clone()
+    dist.all_reduce(tensor)
+    return tensor / get_world_size()
@@ -6,12 +6,161 @@ This file is adopted from robomimic
 https://github.com/ARISE-Initiative/robomimic/blob/master/robomimic/utils/file_utils.py
 """
 import os
+import json
 import h5py
+import hashlib
+import warnings
+import numpy as np
 from collections import OrderedDict
 
 import quest.utils.obs_utils as ObsUtils
 
 
+DATASET_INDEX_VERSION = 2
+
+
+def get_dataset_index_path(dataset_path):
+    """
+    Returns the path of the index sidecar file of the hdf5 dataset at @dataset_path.
+    """
+    return os.path.splitext(os.path.expanduser(dataset_path))[0] + ".index.json"
+
+
+def get_dataset_file_stats(dataset_path):
+    dataset_path = os.path.abspath(os.path.expanduser(dataset_path))
+    stat = os.stat(dataset_path)
+    return {"path": dataset_path, "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def load_dataset_index(dataset_path):
+    """
+    Loads the index sidecar of the hdf5 dataset at @dataset_path.
+
+    Returns:
+        index (dict or None): the index, or None if it is missing, has an older version or
+            was built from a different version of the dataset file
+    """
+    index_path = get_dataset_index_path(dataset_path)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        with open(index_path, "r") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != DATASET_INDEX_VERSION or index.get("source") != get_dataset_file_stats(dataset_path):
+        return None
+    return index
+
+
+def save_dataset_index(dataset_path, index):
+    """
+    Atomically writes @index to the index sidecar of the hdf5 dataset at @dataset_path. Failing
+    to write it (e.g. for datasets in read-only directories) only emits a warning.
+    """
+    index_path = get_dataset_index_path(dataset_path)
+    tmp_path = "{}.tmp-{}".format(index_path, os.getpid())
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        warnings.warn("could not write dataset index {}: {}".format(index_path, e))
+
+
+def build_dataset_index(dataset_path, hdf5_file=None):
+    """
+    Scans the hdf5 dataset at @dataset_path for the information needed to construct a
+    SequenceDataset, so that later runs can skip the scan (see @get_dataset_index).
+
+    Args:
+        dataset_path (str): path to dataset
+        hdf5_file (h5py.File): optional open handle to the dataset
+
+    Returns:
+        index (dict): dictionary with the following keys
+
+            :`'version'`: version of the index format
+            :`'source'`: path, size and modification time of the dataset file
+            :`'demos'`: demo keys in the order of the file, which is lexicographic, so that
+                taking the first n_demos picks the same demos as reading the file directly
+            :`'demo_lengths'`: number of samples per demo
+            :`'demo_offsets'`: index of the first sample of every demo in the whole dataset
+            :`'masks'`: demo keys of every filter key
+            :`'shapes'`: shape and dtype of every key of the first demo, e.g. 'obs/agentview_rgb'
+            :`'normalization_stats'`: observation normalization stats (see @save_normalization_stats)
+    """
+    f = h5py.File(os.path.expanduser(dataset_path), "r") if hdf5_file is None else hdf5_file
+    demos = list(f["data"].keys())
+    demo_lengths = {ep: int(f["data/{}".format(ep)].attrs["num_samples"]) for ep in demos}
+    demo_offsets = dict(zip(demos, np.cumsum([0] + [demo_lengths[ep] for ep in demos[:-1]]).tolist()))
+
+    masks = dict()
+    if "mask" in f:
+        for name in f["mask"]:
+            masks[name] = [elem.decode("utf-8") for elem in np.array(f["mask/{}".format(name)][:])]
+
+    shapes = dict()
+    if len(demos) > 0:
+        def _add_shape(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                shapes[name] = {"shape": list(obj.shape[1:]), "dtype": obj.dtype.str}
+        f["data/{}".format(demos[0])].visititems(_add_shape)
+
+    if hdf5_file is None:
+        f.close()
+    return {
+        "version": DATASET_INDEX_VERSION,
+        "source": get_dataset_file_stats(dataset_path),
+        "demos": demos,
+        "demo_lengths": demo_lengths,
+        "demo_offsets": demo_offsets,
+        "masks": masks,
+        "shapes": shapes,
+        "normalization_stats": dict(),
+    }
+
+
+def get_dataset_index(dataset_path, hdf5_file=None):
+    """
+    Returns the index of the hdf5 dataset at @dataset_path, loading it from its sidecar file if it
+    is up to date and scanning the dataset and writing the sidecar otherwise.
+    """
+    index = load_dataset_index(dataset_path)
+    if index is None:
+        index = build_dataset_index(dataset_path, hdf5_file=hdf5_file)
+        save_dataset_index(dataset_path, index)
+    return index
+
+
+def get_normalization_stats_key(obs_keys, demos):
+    """
+    Key under which normalization stats computed over @obs_keys of @demos are stored in the index.
+    """
+    return hashlib.sha1(json.dumps([sorted(obs_keys), list(demos)]).encode()).hexdigest()[:16]
+
+
+def load_normalization_stats(index, obs_keys, demos):
+    """
+    Returns the observation normalization stats stored in @index for @obs_keys of @demos, or None.
+    """
+    stats = index["normalization_stats"].get(get_normalization_stats_key(obs_keys, demos))
+    if stats is None:
+        return None
+    return {k: {s: np.array(v[s]["data"], dtype=v[s]["dtype"]) for s in v} for k, v in stats.items()}
+
+
+def save_normalization_stats(dataset_path, index, obs_keys, demos, obs_normalization_stats):
+    """
+    Stores @obs_normalization_stats for @obs_keys of @demos in @index and its sidecar file.
+    """
+    index["normalization_stats"][get_normalization_stats_key(obs_keys, demos)] = {
+        k: {s: {"data": np.asarray(v[s]).tolist(), "dtype": np.asarray(v[s]).dtype.str} for s in v}
+        for k, v in obs_normalization_stats.items()
+    }
+    save_dataset_index(dataset_path, index)
+
+
 def get_shape_metadata_from_dataset(dataset_path, all_obs_keys=None, verbose=False):
     """
     Retrieves shape metadata from dataset.
@@ -34,24 +183,32 @@ def get_shape_metadata_from_dataset(dataset_path, all_obs_keys=None, verbose=Fal
 
     shape_meta = {}
 
-    # read demo file for some metadata
+    # read shapes from the dataset index if it is up to date, to avoid opening the file
     dataset_path = os.path.expanduser(dataset_path)
-    f = h5py.File(dataset_path, "r")
-    demo_id = list(f["data"].keys())[0]
-    demo = f["data/{}".format(demo_id)]
+    index = load_dataset_index(dataset_path)
+    if index is not None:
+        shapes = {k: tuple(v["shape"]) for k, v in index["shapes"].items()}
+    else:
+        # read demo file for some metadata
+        f = h5py.File(dataset_path, "r")
+        demo_id = list(f["data"].keys())[0]
+        shapes = dict()
+        f["data/{}".format(demo_id)].visititems(
+            lambda name, obj: shapes.update({name: obj.shape[1:]}) if isinstance(obj, h5py.Dataset) else None)
+        f.close()
 
     # action dimension
-    shape_meta['ac_dim'] = f["data/{}/actions".format(demo_id)].shape[1]
+    shape_meta['ac_dim'] = shapes["actions"][0]
 
     # observation dimensions
     all_shapes = OrderedDict()
 
     if all_obs_keys is None:
         # use all modalities present in the file
-        all_obs_keys = [k for k in demo["obs"]]
+        all_obs_keys = [k.split("/", 1)[1] for k in shapes if k.startswith("obs/")]
 
     for k in sorted(all_obs_keys):
-        initial_shape = demo["obs/{}".format(k)].shape[1:]
+        initial_shape = shapes["obs/{}".format(k)]
         if verbose:
             print("obs key {} with shape {}".format(k, initial_shape))
         # Store processed shape for each obs key
@@ -60,8 +217,6 @@ def get_shape_metadata_from_dataset(dataset_path, all_obs_keys=None, verbose=Fal
             input_shape=initial_shape,
         )
 
-    f.close()
-
     shape_meta['all_shapes'] = all_shapes
     shape_meta['all_obs_keys'] = all_obs_keys
     shape_meta['use_images'] = ObsUtils.has_modality("rgb", all_obs_keys)
@@ -0,0 +1,184 @@
+"""
+Serves a single policy to many env worker processes, e.g. for evaluation or data collection
+with many parallel envs, so that every worker doesn't need its own copy of the model and doesn't
+run inference with a batch size of 1. Observations of the workers are sent to the server over
+multiprocessing queues, batched, and answered with action chunks:
+
+    server = InferenceServer(policy, n_clients=16, max_batch_size=16, max_wait_ms=5)
+    server.start()
+    workers = [mp.Process(target=rollout, args=(server.get_client(i),)) for i in range(16)]
+    ...
+    server.stop()
+
+where rollout uses the client like a policy, i.e. calls client.reset() and
+client.get_action(obs, task_id, task_emb) (see the env runners). Queues are created with the
+start method of @mp_context, and the clients must be passed to processes of the same context.
+"""
+import multiprocessing as mp
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+import numpy as np
+import torch
+
+from quest.algos.base import ChunkPolicy
+
+
+class PolicyClient:
+    """
+    Stand-in for a policy in env worker processes, with the reset and get_action of Policy. Like
+    ChunkPolicy, it keeps a queue of the actions of the last chunk, and only requests a new chunk
+    from the server once the queue is empty.
+
+    Args:
+        client_id (int): index of the response queue of this client
+        request_queue (multiprocessing.Queue): queue of requests to the server
+        response_queue (multiprocessing.Queue): queue of the chunks for this client
+        timeout (float): seconds to wait for a chunk before raising a TimeoutError, e.g. when
+            the server was stopped or its thread died. None waits forever
+    """
+    def __init__(self, client_id, request_queue, response_queue, timeout=60.):
+        self.client_id = client_id
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.timeout = timeout
+        self.action_queue = None
+
+    def reset(self):
+        self.action_queue = deque()
+
+    def get_action(self, obs, task_id, task_emb=None):
+        assert self.action_queue is not None, "you need to call policy.reset() before getting actions"
+        if len(self.action_queue) == 0:
+            if torch.is_tensor(task_emb):
+                task_emb = task_emb.cpu().numpy()
+            self.request_queue.put((self.client_id, obs, task_id, task_emb))
+            try:
+                chunk = self.response_queue.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(
+                    f"no response from the inference server within {self.timeout}s") from None
+            if isinstance(chunk, BaseException):
+                raise chunk
+            self.action_queue.extend(chunk)
+        return self.action_queue.popleft()
+
+
+class InferenceServer:
+    """
+    Answers the requests of @PolicyClients with dynamic batching. The server waits for a
+    request, then gathers further requests until @max_batch_size envs are batched or
+    @max_wait_ms have passed since the first one, and runs sample_actions once on the
+    concatenated observations. Every client gets back the first action_horizon actions of its
+    envs for chunk policies, or a single action otherwise. Requests have the observations of
+    the envs of a client with a leading batch dimension, as passed to Policy.get_action, and
+    all clients must have the same observation shapes and kind of task conditioning.
+
+    The server runs in a thread of the process that holds the policy (see @start), and
+    ignores the prefetching settings of chunk policies.
+
+    Args:
+        policy (Policy): policy to serve
+        n_clients (int): number of clients, see @get_client
+        max_batch_size (int): maximum number of envs in a batch, unless a single request has more
+        max_wait_ms (float): maximum time to wait for more requests after the first one of a batch
+        mp_context (multiprocessing.context.BaseContext): context of the client processes,
+            defaults to the default start method
+        client_timeout (float): seconds clients wait for a chunk before raising, see @PolicyClient
+    """
+    def __init__(self, policy, n_clients, max_batch_size=32, max_wait_ms=5., mp_context=None, client_timeout=60.):
+        mp_context = mp_context or mp.get_context()
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.client_timeout = client_timeout
+        self.request_queue = mp_context.Queue()
+        self.response_queues = [mp_context.Queue() for _ in range(n_clients)]
+        self.thread = None
+        # one entry per batch
+        self.stats = {"n_requests": [], "n_envs": [], "wait_ms": [], "inference_ms": []}
+
+    def get_client(self, client_id):
+        return PolicyClient(client_id, self.request_queue, self.response_queues[client_id], timeout=self.client_timeout)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.request_queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def serve(self):
+        self.policy.eval()
+        while True:
+            requests, stop = self.next_batch()
+            if len(requests) > 0:
+                self.answer(requests)
+            if stop:
+                return
+
+    def next_batch(self):
+        """
+        Returns:
+            requests (list): requests of the next batch
+            stop (bool): whether the server was stopped
+        """
+        request = self.request_queue.get()
+        if request is None:
+            return [], True
+        t0 = time.perf_counter()
+        requests = [request]
+        n_envs = self.batch_size(request)
+        while n_envs < self.max_batch_size:
+            timeout = self.max_wait_ms / 1000 - (time.perf_counter() - t0)
+            try:
+                request = self.request_queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                break
+            if request is None:
+                return requests, True
+            requests.append(request)
+            n_envs += self.batch_size(request)
+        self.stats["wait_ms"].append((time.perf_counter() - t0) * 1000)
+        return requests, False
+
+    @staticmethod
+    def batch_size(request):
+        _, obs, _, _ = request
+        return len(next(iter(obs.values())))
+
+    def answer(self, requests):
+        t0 = time.perf_counter()
+        try:
+            chunks = self.predict(requests)
+        except Exception as e:
+            traceback.print_exc()
+            chunks = [RuntimeError(f"inference server failed: {type(e).__name__}: {e}")] * len(requests)
+        self.stats["n_requests"].append(len(requests))
+        self.stats["n_envs"].append(sum(self.batch_size(request) for request in requests))
+        self.stats["inference_ms"].append((time.perf_counter() - t0) * 1000)
+        for (client_id, _, _, _), chunk in zip(requests, chunks):
+            self.response_queues[client_id].put(chunk)
+
+    def predict(self, requests):
+        sizes = [self.batch_size(request) for request in requests]
+        obs = {key: np.concatenate([request[1][key] for request in requests]) for key in requests[0][1]}
+        task_ids = np.concatenate([np.full(size, request[2]) for size, request in zip(sizes, requests)])
+        task_emb = None
+        if requests[0][3] is not None:
+            task_emb = torch.as_tensor(np.concatenate([request[3] for request in requests]))
+        batch = self.policy.prepare_batch(obs, task_ids, task_emb)
+        with torch.no_grad():
+            actions = self.policy.sample_actions(batch)
+        if isinstance(self.policy, ChunkPolicy):
+            # (horizon, batch, action_dim)
+            actions = actions[:self.policy.action_horizon]
+        else:
+            actions = actions[None]
+        offsets = np.cumsum([0] + sizes)
+        return [actions[:, start:end] for start, end in zip(offsets[:-1], offsets[1:])]
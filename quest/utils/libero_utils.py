@@ -10,12 +10,11 @@ import quest.utils.file_utils as FileUtils
 import quest.utils.obs_utils as ObsUtils
 import quest.utils.utils as utils
 from PIL import Image
-from quest.utils.dataset import SequenceDataset
+from quest.utils.dataset import SequenceDataset, BatchedConcatDataset, build_datasets
 from torch.utils.data import Dataset
 from quest.utils.frame_stack import FrameStackObservationFixed
 import torch
 import torch.nn as nn
-from torch.utils.data import ConcatDataset
 # import gym
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 from libero.libero.benchmark import get_benchmark
@@ -31,7 +30,6 @@ import matplotlib.pyplot as plt
 import robosuite.utils.transform_utils as T
 import h5py
 from gymnasium.vector.utils import batch_space
-from tqdm import trange
 np.set_printoptions(suppress=True)
 
 
@@ -182,14 +180,16 @@ def build_dataset(data_prefix,
                   obs_seq_len=1, 
                   load_obs=True,
                   task_embedding_format="clip",
+                  hdf5_cache_mode="low_dim",
+                  hdf5_cache_backend="numpy",
+                  num_build_workers=1,
+                  build_executor="thread",
                   ):
     benchmark = get_benchmark(benchmark_name)()
     n_tasks = benchmark.n_tasks
     few_shot_demos = np.linspace(0, 49, n_demos, dtype=int).tolist() if mode == 'fewshot' else None
     few_shot_demos_list = [f"demo_{i}" for i in few_shot_demos] if few_shot_demos is not None else None
     
-    manip_datasets = []
-    descriptions = []
     # for key, value in shape_meta
     obs_modality = {
         'rgb': list(shape_meta['observation']['rgb'].keys()),
@@ -200,22 +200,30 @@ def build_dataset(data_prefix,
             obs_modality[key] = obs_modality[key] + extra_obs_modality[key]
     # breakpoint()
     ObsUtils.initialize_obs_utils_with_obs_specs({"obs": obs_modality})
-    for i in trange(n_tasks):
-        task_i_dataset = get_dataset(
-            dataset_path=os.path.join(
-                data_prefix, suite_name, benchmark.get_task_demonstration(i)
-            ),
-            obs_modality=obs_modality,
-            seq_len=seq_len,
-            obs_seq_len=obs_seq_len,
-            frame_stack=frame_stack,
-            load_obs=load_obs,
-            few_demos = few_shot_demos_list,
-            n_demos=n_demos,
-        )
-        task_description = benchmark.get_task(i).language
-        descriptions.append(task_description)
-        manip_datasets.append(task_i_dataset)
+    task_kwargs = [dict(
+        dataset_path=os.path.join(
+            data_prefix, suite_name, benchmark.get_task_demonstration(i)
+        ),
+        obs_modality=obs_modality,
+        seq_len=seq_len,
+        obs_seq_len=obs_seq_len,
+        frame_stack=frame_stack,
+        load_obs=load_obs,
+        few_demos = few_shot_demos_list,
+        n_demos=n_demos,
+        hdf5_cache_mode=hdf5_cache_mode,
+    ) for i in range(n_tasks)]
+    manip_datasets = build_datasets(
+        get_dataset,
+        task_kwargs,
+        num_workers=num_build_workers,
+        executor=build_executor,
+        names=[benchmark.get_task(i).name for i in range(n_tasks)],
+    )
+    if hdf5_cache_backend == "shared_memory":
+        for task_i_dataset in manip_datasets:
+            task_i_dataset.share_memory()
+    descriptions = [benchmark.get_task(i).language for i in range(n_tasks)]
     task_embs = get_task_embs(task_embedding_format, descriptions)
     benchmark.set_task_embs(task_embs)
     datasets = [
@@ -223,7 +231,7 @@ def build_dataset(data_prefix,
     ]
     n_demos = [data.n_demos for data in datasets]
     n_sequences = [data.total_num_sequences for data in datasets]
-    concat_dataset = ConcatDataset(datasets)
+    concat_dataset = BatchedConcatDataset(datasets)
     print("\n===================  Benchmark Information  ===================")
     print(f" Name: {benchmark.name}")
     print(f" # Tasks: {n_tasks}")
@@ -240,6 +248,7 @@ def get_dataset(
     frame_stack=1,
     filter_key=None,
     hdf5_cache_mode="low_dim",
+    hdf5_cache_backend="numpy",
     load_obs=True,
     few_demos=None,
     n_demos=None,
@@ -247,13 +256,10 @@ def get_dataset(
     all_obs_keys = []
     for modality_name, modality_list in obs_modality.items():
         all_obs_keys += modality_list
-    shape_meta = FileUtils.get_shape_metadata_from_dataset(
-        dataset_path=dataset_path, all_obs_keys=all_obs_keys, verbose=False
-    )
     seq_len = seq_len
     filter_key = filter_key
     if load_obs:
-        obs_keys = shape_meta["all_obs_keys"]
+        obs_keys = all_obs_keys
     else:
         obs_keys = []
     dataset = SequenceDataset(
@@ -269,6 +275,7 @@ def get_dataset(
         get_pad_mask=False,
         goal_mode=None,
         hdf5_cache_mode=hdf5_cache_mode,  # cache dataset in memory to avoid repeated file i/o
+        hdf5_cache_backend=hdf5_cache_backend,
         hdf5_use_swmr=False,
         hdf5_normalize_obs=None,
         filter_by_attribute=filter_key,  # can optionally provide a filter key here
@@ -294,6 +301,12 @@ class SequenceVLDataset(Dataset):
         return_dict["task_id"] = self.task_id
         return return_dict
 
+    def __getitems__(self, indices):
+        return_dict = self.sequence_dataset.__getitems__(indices)
+        return_dict["task_emb"] = self.task_emb.unsqueeze(0).repeat(len(indices), *([1] * self.task_emb.dim()))
+        return_dict["task_id"] = torch.full((len(indices),), self.task_id, dtype=torch.long)
+        return return_dict
+
 def get_task_embs(task_embedding_format, descriptions):
     logging.set_verbosity_error()
     if task_embedding_format == "bert":
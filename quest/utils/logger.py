@@ -1,30 +1,84 @@
+import json
+import numbers
+
 import wandb
-import numpy as np
+import torch
 
 class Logger:
     """
-    The purpose of this simple logger is to log intermittently and log average values since the last log
+    The purpose of this simple logger is to log intermittently and log average values since the last log.
+    Values can be python numbers or scalar tensors. Tensors are summed on their device, so that they
+    are only copied to the host (which waits for all queued work on the device) once per log.
+    If @jsonl_path is set, every logged scalar is also appended to that file as one json line per
+    log, with its step.
     """
-    def __init__(self, log_interval):
+    def __init__(self, log_interval, jsonl_path=None):
         self.log_interval = log_interval
-        self.data = None
+        self.jsonl_path = jsonl_path
+        self.sums = None
+        self.counts = None
 
     def update(self, info, step):
         info = flatten_dict(info)
-        if self.data is None:
-            self.data = {key: [] for key in info}
-        
-        for key in info:
-            self.data[key].append(info[key])
-        
+        if self.sums is None:
+            self.sums = {}
+            self.counts = {}
+
+        for key, value in info.items():
+            if torch.is_tensor(value):
+                value = value.detach().float()
+            if key in self.sums:
+                self.sums[key] = self.sums[key] + value
+                self.counts[key] += 1
+            else:
+                self.sums[key] = value
+                self.counts[key] = 1
+
         if step % self.log_interval == 0:
-            means = {key: np.mean(value) for key, value in self.data.items()}
-            self.log(means, step)
-            self.data = None
+            self.log(self.get_means(), step)
+            self.sums = None
+            self.counts = None
+
+    def get_means(self):
+        """
+        Returns the average of every value since the last log, with a single copy per device.
+        """
+        sums = dict(self.sums)
+        tensor_keys = [key for key, value in sums.items() if torch.is_tensor(value)]
+        for device in set(sums[key].device for key in tensor_keys):
+            keys = [key for key in tensor_keys if sums[key].device == device]
+            values = torch.stack([sums[key].reshape(()) for key in keys]).tolist()
+            sums.update(zip(keys, values))
+        return {key: value / self.counts[key] for key, value in sums.items()}
 
     def log(self, info, step):
         info_flat = flatten_dict(info)
         wandb.log(info_flat, step=step)
+        self.write_jsonl(info_flat, step)
+
+    def log_delayed(self, info, step, current_step, step_metric):
+        """
+        Log values measured for an earlier @step (e.g. rollouts of weights from that step) at
+        @current_step, since wandb steps must increase. @step is logged under @step_metric, which
+        should be set as the x axis of these values with wandb.define_metric.
+        """
+        info_flat = flatten_dict(info)
+        info_flat[step_metric] = step
+        wandb.log(info_flat, step=current_step)
+        self.write_jsonl(info_flat, current_step)
+
+    def write_jsonl(self, info_flat, step):
+        if self.jsonl_path is None:
+            return
+        # skip values json can't represent, e.g. videos
+        record = {"step": step}
+        for key, value in info_flat.items():
+            if isinstance(value, (bool, str)):
+                record[key] = value
+            elif isinstance(value, numbers.Number):
+                record[key] = float(value)
+        with open(self.jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
 
 
 def flatten_dict(in_dict):
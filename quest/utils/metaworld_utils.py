@@ -5,7 +5,7 @@ import numpy as np
 import quest.utils.file_utils as FileUtils
 import quest.utils.obs_utils as ObsUtils
 from PIL import Image
-from quest.utils.dataset import SequenceDataset
+from quest.utils.dataset import SequenceDataset, BatchedConcatDataset, build_datasets
 from torch.utils.data import Dataset
 from quest.utils.frame_stack import FrameStackObservationFixed
 import torch
@@ -15,7 +15,6 @@ from gymnasium.envs.mujoco.mujoco_rendering import OffScreenViewer
 import math
 import mujoco
 import os
-from torch.utils.data import ConcatDataset
 import metaworld
 
 from metaworld.envs import ALL_V2_ENVIRONMENTS_GOAL_OBSERVABLE
@@ -376,11 +375,14 @@ def build_dataset(data_prefix,
                   load_obs=True,
                   n_demos=None,
                   load_next_obs=False,
-                  dataset_keys=('actions',)
+                  dataset_keys=('actions',),
+                  hdf5_cache_mode="low_dim",
+                  hdf5_cache_backend="numpy",
+                  num_build_workers=1,
+                  build_executor="thread",
                   ):
     task_names = get_env_names(benchmark_name, mode)
     n_tasks = len(task_names)
-    datasets = []
 
     obs_modality = {
         'rgb': list(shape_meta['observation']['rgb'].keys()),
@@ -391,32 +393,43 @@ def build_dataset(data_prefix,
             obs_modality[key] = obs_modality[key] + extra_obs_modality[key]
 
     ObsUtils.initialize_obs_utils_with_obs_specs({"obs": obs_modality})
-    for task_name in task_names:
+    task_kwargs = [dict(
         # currently we assume tasks from same benchmark have the same shape_meta
-        task_i_dataset = get_task_dataset(
-            dataset_path=os.path.join(
-                data_prefix, 
-                suite_name,
-                benchmark_name,
-                mode,
-                f"{task_name}.hdf5"
-            ),
-            obs_modality=obs_modality,
-            seq_len=seq_len,
-            obs_seq_len=obs_seq_len,
-            lowdim_obs_seq_len=lowdim_obs_seq_len,
-            load_obs=load_obs,
-            frame_stack=frame_stack,
-            n_demos=n_demos,
-            load_next_obs=load_next_obs,
-            dataset_keys=dataset_keys
-        )
-        # loaded_datasets.append(task_i_dataset)
+        dataset_path=os.path.join(
+            data_prefix, 
+            suite_name,
+            benchmark_name,
+            mode,
+            f"{task_name}.hdf5"
+        ),
+        obs_modality=obs_modality,
+        seq_len=seq_len,
+        obs_seq_len=obs_seq_len,
+        lowdim_obs_seq_len=lowdim_obs_seq_len,
+        load_obs=load_obs,
+        frame_stack=frame_stack,
+        n_demos=n_demos,
+        load_next_obs=load_next_obs,
+        dataset_keys=dataset_keys,
+        hdf5_cache_mode=hdf5_cache_mode,
+    ) for task_name in task_names]
+    task_datasets = build_datasets(
+        get_task_dataset,
+        task_kwargs,
+        num_workers=num_build_workers,
+        executor=build_executor,
+        names=task_names,
+    )
+
+    datasets = []
+    for task_name, task_i_dataset in zip(task_names, task_datasets):
+        if hdf5_cache_backend == "shared_memory":
+            task_i_dataset.share_memory()
         task_id = get_index(task_name)
         datasets.append(SequenceVLDataset(task_i_dataset, task_id))
     n_demos = [dataset.n_demos for dataset in datasets]
     n_sequences = [dataset.total_num_sequences for dataset in datasets]
-    concat_dataset = ConcatDataset(datasets)
+    concat_dataset = BatchedConcatDataset(datasets)
     print("\n===================  Benchmark Information  ===================")
     print(f" Name: MetaWorld")
     print(f" # Tasks: {n_tasks}")
@@ -436,6 +449,7 @@ def get_task_dataset(
     frame_stack=1,
     filter_key=None,
     hdf5_cache_mode="low_dim",
+    hdf5_cache_backend="numpy",
     few_demos=None,
     load_obs=True,
     n_demos=None,
@@ -445,13 +459,10 @@ def get_task_dataset(
     all_obs_keys = []
     for modality_name, modality_list in obs_modality.items():
         all_obs_keys += modality_list
-    shape_meta = FileUtils.get_shape_metadata_from_dataset(
-        dataset_path=dataset_path, all_obs_keys=all_obs_keys, verbose=False
-    )
     seq_len = seq_len
     filter_key = filter_key
     if load_obs:
-        obs_keys = shape_meta["all_obs_keys"]
+        obs_keys = all_obs_keys
     else:
         obs_keys = []
 
@@ -471,6 +482,7 @@ def get_task_dataset(
         get_pad_mask=False,
         goal_mode=None,
         hdf5_cache_mode=hdf5_cache_mode,  # cache dataset in memory to avoid repeated file i/o
+        hdf5_cache_backend=hdf5_cache_backend,
         hdf5_use_swmr=False,
         hdf5_normalize_obs=None,
         filter_by_attribute=filter_key,  # can optionally provide a filter key here
@@ -496,6 +508,11 @@ class SequenceVLDataset(Dataset):
         return_dict["task_id"] = self.task_id
         return return_dict
 
+    def __getitems__(self, indices):
+        return_dict = self.sequence_dataset.__getitems__(indices)
+        return_dict["task_id"] = torch.full((len(indices),), self.task_id, dtype=torch.long)
+        return return_dict
+
 
 class ML45PRISEBenchmark(object):
     def __init__(self):
@@ -0,0 +1,108 @@
+"""
+Utilities for sharing numpy arrays between the training process and its DataLoader workers
+without copying them, regardless of the multiprocessing start method.
+"""
+import os
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _align(offset, alignment=64):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to an existing shared memory block without taking ownership of it.
+    """
+    try:
+        # python >= 3.13, keeps the attaching process from unlinking the block at exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # older versions register the block with the resource tracker, which is shared with the
+        # process that created it (DataLoader workers are started by that process), so it is
+        # still only unlinked once
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedArrayDict(Mapping):
+    """
+    Read-only dictionary of numpy arrays that are stored back to back in a single
+    multiprocessing shared memory block. Pickling only sends the name of the block and the
+    layout of the arrays, so the arrays are never copied into worker processes, and unpickled
+    copies map the same physical memory. The block is unlinked when the instance that created it
+    is closed or garbage collected in the creating process.
+
+    Args:
+        arrays (dict): dictionary mapping keys to numpy arrays to copy into shared memory
+    """
+    def __init__(self, arrays):
+        self._layout = dict()
+        size = 0
+        for k, v in arrays.items():
+            v = np.asarray(v)
+            size = _align(size)
+            self._layout[k] = (size, v.shape, v.dtype.str)
+            size += v.nbytes
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._owner_pid = os.getpid()
+        self._arrays = self._map_arrays(writeable=True)
+        for k, v in arrays.items():
+            self._arrays[k][...] = v
+            self._arrays[k].flags.writeable = False
+
+    def _map_arrays(self, writeable=False):
+        arrays = dict()
+        for k, (offset, shape, dtype) in self._layout.items():
+            arrays[k] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shm.buf, offset=offset)
+            arrays[k].flags.writeable = writeable
+        return arrays
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def nbytes(self):
+        return self._shm.size
+
+    def __getitem__(self, key):
+        return self._arrays[key]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "layout": self._layout}
+
+    def __setstate__(self, state):
+        self._layout = state["layout"]
+        self._shm = _attach_shared_memory(state["name"])
+        self._owner_pid = None
+        self._arrays = self._map_arrays()
+
+    def close(self):
+        """
+        Release this process' mapping of the block, and unlink the block if this instance created it.
+        Arrays previously returned by this dictionary must not be used afterwards.
+        """
+        if getattr(self, "_shm", None) is None:
+            return
+        self._arrays = dict()
+        try:
+            self._shm.close()
+        except BufferError:
+            # views of the arrays are still alive, the mapping is released with them
+            pass
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+    def __del__(self):
+        self.close()
@@ -1,7 +1,12 @@
 import copy
 import json
 import os
+import queue
 import random
+import resource
+import sys
+import threading
+import time
 from pathlib import Path
 import quest.utils.tensor_utils as TensorUtils
 import numpy as np
@@ -63,10 +68,46 @@ def get_latest_checkpoint(checkpoint_dir):
         return checkpoint_dir
 
     onlyfiles = [f for f in os.listdir(checkpoint_dir) if os.path.isfile(os.path.join(checkpoint_dir, f))]
+    # skip checkpoints that are still being written or were interrupted
+    onlyfiles = [f for f in onlyfiles if not is_temporary_checkpoint(f)]
     onlyfiles = natsorted(onlyfiles)
     best_file = onlyfiles[-1]
     return os.path.join(checkpoint_dir, best_file)
 
+def get_resume_checkpoint(checkpoint_dir):
+    """
+    Returns the most recently written checkpoint in @checkpoint_dir, which can be a step
+    checkpoint or an epoch checkpoint, or None if there is none.
+    """
+    paths = [path for path in Path(checkpoint_dir).glob("*.pth")
+             if path.is_file() and not is_temporary_checkpoint(path)]
+    if len(paths) == 0:
+        return None
+    return str(max(paths, key=lambda path: path.stat().st_mtime))
+
+def get_rng_states():
+    """
+    Returns the states of the python, numpy and torch random number generators.
+    """
+    # only tensors and python types, so that checkpoints can be loaded with weights_only
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    states = {
+        "python": random.getstate(),
+        "numpy": (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+def set_rng_states(states):
+    random.setstate(states["python"])
+    name, keys, pos, has_gauss, cached_gaussian = states["numpy"]
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    torch.set_rng_state(states["torch"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
 def soft_load_state_dict(model, loaded_state_dict):
     # loaded_state_dict['task_encoder.weight'] = loaded_state_dict['task_encodings.weight']
     
@@ -91,21 +132,246 @@ def soft_load_state_dict(model, loaded_state_dict):
     
     model.load_state_dict(new_state_dict)
 
-def map_tensor_to_device(data, device):
+def map_tensor_to_device(data, device, non_blocking=False):
     """Move data to the device specified by device."""
     return TensorUtils.map_tensor(
-        data, lambda x: safe_device(x, device=device)
+        data, lambda x: safe_device(x, device=device, non_blocking=non_blocking)
     )
 
-def safe_device(x, device="cpu"):
+def safe_device(x, device="cpu", non_blocking=False):
     if device == "cpu":
         return x.cpu()
     elif "cuda" in device:
         if torch.cuda.is_available():
-            return x.to(device)
+            return x.to(device, non_blocking=non_blocking)
         else:
             return x.cpu()
 
+
+class DevicePrefetcher:
+    """
+    Wraps an iterable of batches (e.g. a DataLoader) and moves batch N+1 to @device while the
+    training step on batch N runs. On cuda devices, batches are fetched ahead in the calling
+    thread and copied on a side stream with non-blocking copies, which only overlap compute if
+    the loader pins memory. Otherwise, a background thread fetches and moves up to
+    @num_prefetch batches ahead.
+
+    The time the caller spends waiting for the next batch is accumulated in @wait_time
+    (in seconds) and reset at the beginning of every epoch, along with @num_batches.
+
+    Args:
+        loader: iterable of batches
+        device (str): device to move the batches to
+        num_prefetch (int): number of batches fetched ahead by the background thread
+    """
+    def __init__(self, loader, device, num_prefetch=2):
+        self.loader = loader
+        self.device = device
+        self.num_prefetch = num_prefetch
+        self.use_cuda_stream = "cuda" in device and torch.cuda.is_available()
+        self.wait_time = 0.
+        self.num_batches = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    @property
+    def mean_wait_time(self):
+        return self.wait_time / max(self.num_batches, 1)
+
+    def __iter__(self):
+        self.wait_time = 0.
+        self.num_batches = 0
+        if self.use_cuda_stream:
+            return self._iter_cuda_stream()
+        return self._iter_thread()
+
+    def _iter_cuda_stream(self):
+        stream = torch.cuda.Stream(device=self.device)
+        iterator = iter(self.loader)
+
+        def preload():
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return None
+            with torch.cuda.stream(stream):
+                return map_tensor_to_device(batch, self.device, non_blocking=True)
+
+        start = time.perf_counter()
+        batch = preload()
+        while batch is not None:
+            torch.cuda.current_stream(self.device).wait_stream(stream)
+            # tensors allocated on the side stream must not be reused before the step is done with them
+            TensorUtils.map_tensor(batch, lambda x: x.record_stream(torch.cuda.current_stream(self.device)))
+            next_batch = preload()
+            self.wait_time += time.perf_counter() - start
+            self.num_batches += 1
+            yield batch
+            start = time.perf_counter()
+            batch = next_batch
+
+    def _iter_thread(self):
+        batches = queue.Queue(maxsize=max(self.num_prefetch, 1))
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # give up if the consumer stopped iterating, e.g. after breaking out of the epoch early
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for batch in self.loader:
+                    if not put(map_tensor_to_device(batch, self.device)):
+                        return
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = batches.get()
+                self.wait_time += time.perf_counter() - start
+                if batch is done:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                self.num_batches += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+class StepTimer:
+    """
+    Lightweight wall clock timers for the phases of training steps. Every call to @lap charges
+    the time since the previous lap to a phase, and @end_step counts a step and its samples.
+    @summary returns the average time of every phase per step, the throughput and the peak
+    memory since its last call, e.g. once per log interval.
+
+    Without @synchronize, cuda kernels run asynchronously so their time is charged to whichever
+    phase next waits for the device (usually the optimizer step or logging), but the total step
+    time and the throughput are still exact.
+
+    Args:
+        device (str): training device
+        synchronize (bool): if True, wait for the device at every lap so that each phase is
+            charged its own cuda time, at the cost of the overlap of host and device work
+        enabled (bool): if False, all methods are no-ops and @summary returns an empty dict
+    """
+    def __init__(self, device, synchronize=False, enabled=True):
+        self.device = device
+        self.use_cuda = get_device_type(device) == "cuda"
+        self.synchronize = synchronize and self.use_cuda
+        self.enabled = enabled
+        self.clear()
+        self.reset()
+
+    def reset(self):
+        """
+        Restart the clock without charging any phase, e.g. at the start of an epoch so that
+        the time spent on rollouts or checkpoints between epochs is not counted.
+        """
+        self.last_time = time.perf_counter()
+
+    def clear(self):
+        self.phase_times = {}
+        self.num_steps = 0
+        self.num_samples = 0
+
+    def lap(self, phase):
+        if not self.enabled:
+            return
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        self.phase_times[phase] = self.phase_times.get(phase, 0.) + now - self.last_time
+        self.last_time = now
+
+    def end_step(self, num_samples):
+        if not self.enabled:
+            return
+        self.num_steps += 1
+        self.num_samples += num_samples
+
+    def summary(self):
+        """
+        Returns the mean milliseconds per step of every phase and of the whole step, the
+        samples per second and the peak memory since the last call, and clears the timers.
+        """
+        if not self.enabled or self.num_steps == 0:
+            return {}
+        total_time = sum(self.phase_times.values())
+        info = {f"{phase}_ms": t * 1000 / self.num_steps for phase, t in self.phase_times.items()}
+        info["step_ms"] = total_time * 1000 / self.num_steps
+        info["samples_per_sec"] = self.num_samples / max(total_time, 1e-9)
+        info["peak_rss_mb"] = get_peak_rss_mb()
+        if self.use_cuda:
+            info["peak_cuda_memory_mb"] = torch.cuda.max_memory_allocated(self.device) / 2 ** 20
+        self.clear()
+        return info
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident memory of this process in megabytes (not including dataloader
+    workers).
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak_rss / 2 ** 20 if sys.platform == "darwin" else peak_rss / 2 ** 10
+
+def get_device_type(device):
+    """
+    Returns the torch device type ("cuda" or "cpu") that @device resolves to with safe_device.
+    """
+    if "cuda" in device and torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+def get_amp_dtype(device, amp_dtype=None):
+    """
+    Returns the dtype to autocast to for mixed precision training on @device. Defaults to
+    float16 on cuda and bfloat16 on cpu, which is the only reduced precision dtype cpu
+    kernels are optimized for.
+
+    Args:
+        device (str): training device
+        amp_dtype (str): one of [None, "float16", "bfloat16"]
+    """
+    if amp_dtype is None:
+        return torch.float16 if get_device_type(device) == "cuda" else torch.bfloat16
+    assert amp_dtype in ["float16", "bfloat16"], f"unsupported amp dtype {amp_dtype}"
+    return getattr(torch, amp_dtype)
+
+def autocast(device, enabled=True, amp_dtype=None):
+    """
+    Autocast context for @device, see @get_amp_dtype.
+    """
+    return torch.autocast(
+        device_type=get_device_type(device),
+        dtype=get_amp_dtype(device, amp_dtype),
+        enabled=enabled
+    )
+
+def get_grad_scaler(device, enabled=True, amp_dtype=None):
+    """
+    Returns a gradient scaler, which is only enabled for float16 mixed precision on cuda since
+    bfloat16 has the same exponent range as float32 and doesn't need loss scaling.
+    """
+    enabled = enabled and get_device_type(device) == "cuda" and get_amp_dtype(device, amp_dtype) == torch.float16
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
 def extract_state_dicts(inp):
 
     if not (isinstance(inp, dict) or isinstance(inp, list)):
@@ -124,12 +390,115 @@ def extract_state_dicts(inp):
             out_dict[key] = extract_state_dicts(value)
         return out_dict
         
+def snapshot_state_dicts(inp):
+    """
+    Like @extract_state_dicts, but copies every tensor to cpu memory, so that the result
+    can be saved while training keeps updating the model and optimizer states.
+    """
+    def snapshot(x):
+        if isinstance(x, torch.Tensor):
+            return x.detach().to("cpu", copy=True)
+        elif isinstance(x, dict):
+            return {k: snapshot(v) for k, v in x.items()}
+        elif isinstance(x, (list, tuple)):
+            return type(x)(snapshot(v) for v in x)
+        return copy.deepcopy(x)
+    return snapshot(extract_state_dicts(inp))
+
+def is_temporary_checkpoint(path):
+    return ".tmp-" in os.path.basename(path)
+
 def save_state(state_dict, path):
+    """
+    Save @state_dict to @path atomically: the checkpoint is written to a temporary file in the
+    same directory, flushed to disk and then renamed, so @path is never left partially written.
+    """
     save_dict = extract_state_dicts(state_dict)
-    torch.save(save_dict, path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            torch.save(save_dict, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # persist the rename
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def prune_checkpoints(checkpoint_dir, keep_last, pattern="multitask_model_epoch_*.pth"):
+    """
+    Delete all but the @keep_last most recent checkpoints matching @pattern in @checkpoint_dir.
+    """
+    paths = natsorted(str(path) for path in Path(checkpoint_dir).glob(pattern) if not is_temporary_checkpoint(path))
+    for path in paths[:max(len(paths) - keep_last, 0)]:
+        os.remove(path)
+
+
+class CheckpointWriter:
+    """
+    Saves checkpoints without stalling training. @save copies the state to cpu memory and
+    returns, and a background thread writes it with @save_state. At most one checkpoint is
+    written at a time, so saving waits for the previous write to finish first, which bounds
+    the memory used by snapshots.
+
+    Args:
+        keep_last (int): if not None, only keep the @keep_last most recent checkpoints
+            matching @prune_pattern in the directory of each saved checkpoint
+        prune_pattern (str): glob of the checkpoints to prune
+        asynchronous (bool): if False, write checkpoints in the calling thread
+    """
+    def __init__(self, keep_last=None, prune_pattern="multitask_model_epoch_*.pth", asynchronous=True):
+        self.keep_last = keep_last
+        self.prune_pattern = prune_pattern
+        self.asynchronous = asynchronous
+        self.thread = None
+        self.error = None
+
+    def save(self, state_dict, path):
+        self.wait()
+        snapshot = snapshot_state_dicts(state_dict)
+        if not self.asynchronous:
+            self._write(snapshot, path)
+            return
+        self.thread = threading.Thread(target=self._write_in_background, args=(snapshot, path))
+        self.thread.start()
+
+    def _write(self, snapshot, path):
+        save_state(snapshot, path)
+        if self.keep_last is not None:
+            prune_checkpoints(os.path.dirname(os.path.abspath(path)), self.keep_last, self.prune_pattern)
+
+    def _write_in_background(self, snapshot, path):
+        try:
+            self._write(snapshot, path)
+        except BaseException as e:
+            self.error = e
+
+    def wait(self):
+        """
+        Block until the pending checkpoint is written, re-raising any error that occurred.
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.wait()
 
 def load_state(path):
-    return torch.load(path)
+    # tensors are loaded on the cpu rather than the device they were saved from, since
+    # checkpoints are broadcast to every rank and copied to the right device when loaded
+    return torch.load(path, map_location="cpu")
 
 def torch_save_model(model, optimizer, scheduler, model_path, cfg=None):
     torch.save(
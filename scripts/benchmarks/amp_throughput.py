@@ -0,0 +1,66 @@
+"""
+Compares training step throughput in float32 and with mixed precision (bfloat16 autocast by
+default on cpu, float16 on cuda) for every algo config, on synthetic batches shaped like the
+task's datasets. Stage 0 (autoencoder) and stage 1 (prior) are benchmarked separately for the
+algos that have an autoencoder.
+
+    python scripts/benchmarks/amp_throughput.py --device cpu --batch_size 32 \
+        --overrides task.img_height=64 task.img_width=64
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+
+AUTOENCODER_ALGOS = ["quest", "bet"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algos', nargs='+', default=['quest', 'bet', 'act', 'diffusion_policy', 'bc_transformer'])
+    parser.add_argument('--task', default='metaworld_ml45')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--amp_dtype', default=None, choices=[None, 'float16', 'bfloat16'])
+    parser.add_argument('--channels_last', action='store_true', help='use channels last resnet encoders')
+    parser.add_argument('--n_iters', type=int, default=10)
+    parser.add_argument('--n_warmup', type=int, default=2)
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides')
+    args = parser.parse_args()
+
+    runs = []
+    for algo in args.algos:
+        if algo in AUTOENCODER_ALGOS:
+            runs.append((algo, 'train_autoencoder'))
+        runs.append((algo, 'train_prior'))
+
+    tmp_dir = tempfile.mkdtemp()
+    print(f"{'algo':>16} {'stage':>6} {'fp32 (ms)':>10} {'amp (ms)':>10} {'speedup':>8}")
+    for algo, config_name in runs:
+        overrides = [f'algo.encoder.image.channels_last={args.channels_last}', *args.overrides]
+        cfg = BenchmarkUtils.compose_config(
+            config_name, [f'algo={algo}', f'task={args.task}', f'device={args.device}', *overrides])
+
+        hdf5_path = os.path.join(tmp_dir, f'{args.task}.hdf5')
+        if not os.path.exists(hdf5_path):
+            BenchmarkUtils.write_synthetic_hdf5(hdf5_path, OmegaConf.to_container(cfg.task.shape_meta, resolve=True),
+                                                n_demos=4, demo_length=(100, 150))
+        dataset = BenchmarkUtils.make_synthetic_dataset(cfg, hdf5_path, load_obs=cfg.training.load_obs)
+        batch = BenchmarkUtils.get_synthetic_batch(cfg, dataset, args.batch_size)
+        dataset.close_and_delete_hdf5_handle()
+
+        results = []
+        for use_amp in (False, True):
+            model, _ = BenchmarkUtils.load_policy(algo, args.task, args.device, overrides, config_name=config_name)
+            times = BenchmarkUtils.time_training_steps(
+                model, batch, n_iters=args.n_iters, n_warmup=args.n_warmup, use_amp=use_amp, amp_dtype=args.amp_dtype)
+            results.append(np.median(times))
+        print(f"{algo:>16} {cfg.stage:>6} {results[0]:>10.1f} {results[1]:>10.1f} {results[0] / results[1]:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares training step time of eager and torch.compile'd policies (see
+Policy.compile_hot_paths) for every algo config, on synthetic batches shaped like the task's
+datasets, and lists the graph breaks dynamo finds in compute_loss and sample_actions. Compilation
+happens during the warmup steps and is reported separately.
+
+    python scripts/benchmarks/compile_speedup.py --device cpu --batch_size 32 \
+        --overrides task.img_height=64 task.img_width=64
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+
+AUTOENCODER_ALGOS = ["quest", "bet"]
+
+
+def copy_batch(batch):
+    # compute_loss and sample_actions may modify the batch in place
+    return {k: dict(v) if isinstance(v, dict) else v for k, v in batch.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algos', nargs='+', default=['quest', 'bet', 'act', 'diffusion_policy', 'bc_transformer'])
+    parser.add_argument('--task', default='metaworld_ml45')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--mode', default=None, help='torch.compile mode')
+    parser.add_argument('--n_iters', type=int, default=10)
+    parser.add_argument('--n_warmup', type=int, default=3)
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides')
+    args = parser.parse_args()
+
+    runs = []
+    for algo in args.algos:
+        if algo in AUTOENCODER_ALGOS:
+            runs.append((algo, 'train_autoencoder'))
+        runs.append((algo, 'train_prior'))
+
+    tmp_dir = tempfile.mkdtemp()
+    graph_breaks = []
+    print(f"{'algo':>16} {'stage':>6} {'eager (ms)':>11} {'compiled (ms)':>14} {'speedup':>8} {'warmup (s)':>11}")
+    for algo, config_name in runs:
+        model, cfg = BenchmarkUtils.load_policy(algo, args.task, args.device, args.overrides, config_name=config_name)
+
+        hdf5_path = os.path.join(tmp_dir, f'{args.task}.hdf5')
+        if not os.path.exists(hdf5_path):
+            BenchmarkUtils.write_synthetic_hdf5(hdf5_path, OmegaConf.to_container(cfg.task.shape_meta, resolve=True),
+                                                n_demos=4, demo_length=(100, 150))
+        dataset = BenchmarkUtils.make_synthetic_dataset(cfg, hdf5_path, load_obs=cfg.training.load_obs)
+        batch = BenchmarkUtils.get_synthetic_batch(cfg, dataset, args.batch_size)
+        dataset.close_and_delete_hdf5_handle()
+
+        hot_paths = [('compute_loss', model.compute_loss)]
+        if cfg.stage > 0:
+            # only policies past the autoencoder stage can sample actions
+            hot_paths.append(('sample_actions', model.sample_actions))
+        for name, fn in hot_paths:
+            model.train(name == 'compute_loss')
+            try:
+                n_graphs, break_reasons = BenchmarkUtils.explain_graph_breaks(fn, copy_batch(batch))
+            except Exception as e:
+                # e.g. configs whose sample_actions doesn't run in eager mode either
+                n_graphs, break_reasons = None, [f'tracing failed: {str(e).strip().splitlines()[0]}']
+            graph_breaks.append((algo, cfg.stage, name, n_graphs, break_reasons))
+        eager_times = BenchmarkUtils.time_training_steps(model, batch, n_iters=args.n_iters, n_warmup=args.n_warmup)
+
+        torch._dynamo.reset()
+        model, _ = BenchmarkUtils.load_policy(algo, args.task, args.device, args.overrides, config_name=config_name)
+        model.compile_hot_paths(mode=args.mode)
+        t0 = time.perf_counter()
+        compiled_times = BenchmarkUtils.time_training_steps(model, batch, n_iters=args.n_iters, n_warmup=args.n_warmup)
+        warmup_time = time.perf_counter() - t0 - compiled_times.sum() / 1000
+        torch._dynamo.reset()
+        eager, compiled = np.median(eager_times), np.median(compiled_times)
+        print(f"{algo:>16} {cfg.stage:>6} {eager:>11.1f} {compiled:>14.1f} {eager / compiled:>7.2f}x {warmup_time:>11.1f}")
+    print()
+    print("graph breaks:")
+    for algo, stage, name, n_graphs, break_reasons in graph_breaks:
+        print(f"{algo} stage {stage} {name}: {n_graphs if n_graphs is not None else '?'} graph(s)")
+        for reason in break_reasons:
+            print(f"    {reason}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Control latency of policy.get_action, rolled out in a stub env with the observation shapes of a
+task config, so that it needs neither LIBERO nor MetaWorld. Chunk policies have a sawtooth
+latency profile: get_action pops the action queue for most calls and runs sample_actions when
+the queue is empty, so besides the latency percentiles over all calls this reports the cost of
+the calls that predict a new chunk, and its breakdown into obs conversion, encoding and decoding
+(see quest.utils.benchmark_utils.profile_get_action). Policies are randomly initialized, which
+doesn't change their latency.
+
+    python scripts/benchmarks/inference_latency.py --device cpu --batch_sizes 1 4 16 \
+        --overrides ++algo.direct_skill_tokens=false
+
+Chunks can be prefetched while the env steps (see ChunkPolicy), e.g. with a 20ms env step
+
+    python scripts/benchmarks/inference_latency.py --algos quest --env_step_ms 20 \
+        --overrides ++algo.direct_skill_tokens=false algo.prefetch_distance=2
+"""
+import argparse
+import json
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+
+
+def summarize(timings, batch_size):
+    latency = timings["latency_ms"]
+    sampled = timings["sampled"]
+    summary = {
+        "p50_ms": np.percentile(latency, 50),
+        "p90_ms": np.percentile(latency, 90),
+        "p99_ms": np.percentile(latency, 99),
+        "max_ms": latency.max(),
+        "mean_ms": latency.mean(),
+        "actions_per_sec": batch_size * len(latency) / latency.sum() * 1000,
+        "calls_per_chunk": len(latency) / max(sampled.sum(), 1),
+    }
+    if sampled.any():
+        summary["chunk_ms"] = np.median(latency[sampled])
+        for phase in ("obs_conversion", "encode", "decode"):
+            summary[f"chunk_{phase}_ms"] = np.median(timings[f"{phase}_ms"][sampled])
+    if not sampled.all():
+        summary["queue_ms"] = np.median(latency[~sampled])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algos', nargs='+', default=['quest', 'act', 'diffusion_policy', 'bet', 'bc_transformer'])
+    parser.add_argument('--task', default='metaworld_ml45', help='task config providing the shape_meta')
+    parser.add_argument('--img_size', type=int, default=None, help='defaults to the image size of the task config')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 16], help='numbers of parallel envs')
+    parser.add_argument('--n_steps', type=int, default=64, help='timed get_action calls per batch size')
+    parser.add_argument('--n_warmup', type=int, default=8)
+    parser.add_argument('--env_step_ms', type=float, default=0., help='simulated duration of an env step')
+    parser.add_argument('--compile', action='store_true', help='torch.compile sample_actions first')
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides')
+    args = parser.parse_args()
+
+    # the latencies of the last three columns are of the calls that sample a chunk
+    columns = {
+        'p50_ms': 'p50 ms',
+        'p90_ms': 'p90 ms',
+        'p99_ms': 'p99 ms',
+        'max_ms': 'max ms',
+        'queue_ms': 'queue ms',
+        'chunk_ms': 'chunk ms',
+        'actions_per_sec': 'actions/s',
+        'chunk_obs_conversion_ms': 'obs conv ms',
+        'chunk_encode_ms': 'encode ms',
+        'chunk_decode_ms': 'decode ms',
+    }
+    print(f"{'algo':>16} {'batch':>5} " + " ".join(f"{name:>12}" for name in columns.values()))
+
+    results = {}
+    for algo in args.algos:
+        overrides = list(args.overrides)
+        if args.img_size is not None:
+            overrides += [f"task.img_height={args.img_size}", f"task.img_width={args.img_size}"]
+        model, cfg = BenchmarkUtils.load_policy(algo, args.task, args.device, overrides)
+        shape_meta = OmegaConf.to_container(cfg.task.shape_meta, resolve=True)
+        if args.compile:
+            model.compile_hot_paths()
+
+        for batch_size in args.batch_sizes:
+            env = BenchmarkUtils.StubEnv(shape_meta, n_envs=batch_size, frame_stack=cfg.algo.frame_stack,
+                                          step_ms=args.env_step_ms)
+            task_emb = None
+            if shape_meta["task"]["type"] != "onehot":
+                task_emb = torch.randn(batch_size, shape_meta["task"]["dim"])
+            try:
+                timings = BenchmarkUtils.profile_get_action(
+                    model, env, n_steps=args.n_steps, n_warmup=args.n_warmup, task_emb=task_emb)
+            except Exception as e:
+                # e.g. settings that only work for training, report them and carry on
+                print(f"{algo:>16} {batch_size:>5} failed: {type(e).__name__}: {e}")
+                continue
+            summary = summarize(timings, batch_size)
+            for key, value in summary.items():
+                results[f"{algo}/batch_{batch_size}/{key}"] = float(value)
+            row = " ".join(
+                f"{summary[column]:>12.2f}" if column in summary else f"{'-':>12}" for column in columns)
+            print(f"{algo:>16} {batch_size:>5} {row}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main()
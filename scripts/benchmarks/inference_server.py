@@ -0,0 +1,140 @@
+"""
+Load test of quest.utils.inference_server: every client process rolls out a stub env with the
+observation shapes of a task config (see quest.utils.benchmark_utils.StubEnv) and gets its
+actions from a single server. Reports the throughput in actions/sec over all clients, the
+latency of get_action as seen by the clients, over all calls and over the calls that wait for a
+new chunk, and the batch sizes and inference time of the server. Runs with one client are the
+baseline of a model per env worker.
+
+    python scripts/benchmarks/inference_server.py --algo quest --n_clients 1 4 16 \
+        --max_wait_ms 5 --env_step_ms 10 --overrides algo.direct_skill_tokens=false
+"""
+import argparse
+import json
+import multiprocessing as mp
+import time
+
+import numpy as np
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+from quest.utils.inference_server import InferenceServer
+
+
+def run_client(client, shape_meta, frame_stack, client_id, args, warmup_barrier, start_event, result_queue):
+    env = BenchmarkUtils.StubEnv(shape_meta, n_envs=1, frame_stack=frame_stack, seed=client_id,
+                                 step_ms=args.env_step_ms)
+    task_meta = shape_meta["task"]
+    task_id, task_emb = client_id % task_meta.get("n_tasks", 1), None
+    if task_meta["type"] != "onehot":
+        task_emb = np.random.default_rng(client_id).normal(size=(1, task_meta["dim"])).astype(np.float32)
+    client.reset()
+    obs, _ = env.reset()
+    latencies, sampled = [], []
+    for i in range(args.n_warmup + args.n_steps):
+        if i == args.n_warmup:
+            # every warmup request was answered, wait until the server's batches are counted
+            warmup_barrier.wait()
+            start_event.wait()
+        waits_for_chunk = len(client.action_queue) == 0
+        t0 = time.perf_counter()
+        action = client.get_action(obs, task_id, task_emb)
+        latency = (time.perf_counter() - t0) * 1000
+        obs, _, _, _, _ = env.step(action)
+        if i >= args.n_warmup:
+            latencies.append(latency)
+            sampled.append(waits_for_chunk)
+    result_queue.put((np.array(latencies), np.array(sampled)))
+
+
+def load_test(model, shape_meta, frame_stack, n_clients, args):
+    ctx = mp.get_context(args.start_method)
+    server = InferenceServer(model, n_clients, max_batch_size=args.max_batch_size,
+                             max_wait_ms=args.max_wait_ms, mp_context=ctx)
+    server.start()
+    warmup_barrier = ctx.Barrier(n_clients + 1)
+    start_event = ctx.Event()
+    result_queue = ctx.Queue()
+    clients = [
+        ctx.Process(target=run_client, args=(server.get_client(i), shape_meta, frame_stack, i, args,
+                                             warmup_barrier, start_event, result_queue))
+        for i in range(n_clients)
+    ]
+    for client in clients:
+        client.start()
+    warmup_barrier.wait()
+    # batches of the warmup are not counted. Their stats are recorded before they are answered,
+    # and no client sends a timed request before the event is set
+    n_warmup_batches = len(server.stats["n_envs"])
+    t0 = time.perf_counter()
+    start_event.set()
+    results = [result_queue.get() for _ in clients]
+    wall_time = time.perf_counter() - t0
+    for client in clients:
+        client.join()
+    server.stop()
+
+    latencies = np.concatenate([latency for latency, _ in results])
+    sampled = np.concatenate([sampled for _, sampled in results])
+    stats = {key: np.array(value[n_warmup_batches:]) for key, value in server.stats.items()}
+    return {
+        "actions_per_sec": len(latencies) / wall_time,
+        "p50_ms": np.percentile(latencies, 50),
+        "p99_ms": np.percentile(latencies, 99),
+        "chunk_p50_ms": np.percentile(latencies[sampled], 50),
+        "chunk_p99_ms": np.percentile(latencies[sampled], 99),
+        "mean_batch_size": stats["n_envs"].mean(),
+        "mean_batch_wait_ms": stats["wait_ms"].mean(),
+        "mean_inference_ms": stats["inference_ms"].mean(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--algo', default='quest')
+    parser.add_argument('--task', default='metaworld_ml45', help='task config providing the shape_meta')
+    parser.add_argument('--img_size', type=int, default=None, help='defaults to the image size of the task config')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--n_clients', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=5.)
+    parser.add_argument('--n_steps', type=int, default=64, help='timed get_action calls per client')
+    parser.add_argument('--n_warmup', type=int, default=8)
+    parser.add_argument('--env_step_ms', type=float, default=0., help='simulated duration of an env step')
+    parser.add_argument('--start_method', default='spawn', help='multiprocessing start method of the clients')
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides')
+    args = parser.parse_args()
+
+    overrides = list(args.overrides)
+    if args.img_size is not None:
+        overrides += [f"task.img_height={args.img_size}", f"task.img_width={args.img_size}"]
+    model, cfg = BenchmarkUtils.load_policy(args.algo, args.task, args.device, overrides)
+    shape_meta = OmegaConf.to_container(cfg.task.shape_meta, resolve=True)
+
+    columns = {
+        'actions_per_sec': 'actions/s',
+        'p50_ms': 'p50 ms',
+        'p99_ms': 'p99 ms',
+        'chunk_p50_ms': 'chunk p50 ms',
+        'chunk_p99_ms': 'chunk p99 ms',
+        'mean_batch_size': 'batch size',
+        'mean_batch_wait_ms': 'wait ms',
+        'mean_inference_ms': 'inference ms',
+    }
+    print(f"{'clients':>7} " + " ".join(f"{name:>12}" for name in columns.values()))
+    results = {}
+    for n_clients in args.n_clients:
+        summary = load_test(model, shape_meta, cfg.algo.frame_stack, n_clients, args)
+        for key, value in summary.items():
+            results[f"{args.algo}/clients_{n_clients}/{key}"] = float(value)
+        print(f"{n_clients:>7} " + " ".join(f"{summary[column]:>12.2f}" for column in columns))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+if __name__ == '__main__':
+    main()
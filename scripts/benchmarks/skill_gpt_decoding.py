@@ -0,0 +1,94 @@
+"""
+Compares per-chunk latency of SkillGPT.get_indices_top_k with and without the
+key / value cache. Defaults match config/algo/quest.yaml.
+
+    python scripts/benchmarks/skill_gpt_decoding.py --device cpu --batch_sizes 1 5 20
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from quest.algos.quest_modules.skill_gpt import SkillGPT
+
+
+def time_decoding(model, context, codebook_size, use_kv_cache, n_iters, n_warmup):
+    model.use_kv_cache = use_kv_cache
+    times = []
+    with torch.no_grad():
+        for i in range(n_warmup + n_iters):
+            if context.is_cuda:
+                torch.cuda.synchronize()
+            t0 = time.perf_counter()
+            model.get_indices_top_k(context, codebook_size)
+            if context.is_cuda:
+                torch.cuda.synchronize()
+            if i >= n_warmup:
+                times.append(time.perf_counter() - t0)
+    return np.array(times) * 1000
+
+
+def check_parity(model, context, codebook_size):
+    # both paths consume the random numbers in the same order, so with the same seed they
+    # must sample the same skill tokens
+    indices = []
+    with torch.no_grad():
+        for use_kv_cache in (False, True):
+            model.use_kv_cache = use_kv_cache
+            torch.manual_seed(0)
+            indices.append(model.get_indices_top_k(context, codebook_size))
+    return torch.equal(*indices)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--block_size', type=int, default=8)
+    parser.add_argument('--context_len', type=int, default=2)
+    parser.add_argument('--n_layer', type=int, default=6)
+    parser.add_argument('--n_head', type=int, default=6)
+    parser.add_argument('--n_embd', type=int, default=384)
+    parser.add_argument('--vocab_size', type=int, default=1000)
+    parser.add_argument('--n_iters', type=int, default=50)
+    parser.add_argument('--n_warmup', type=int, default=5)
+    args = parser.parse_args()
+
+    model = SkillGPT(
+        action_dim=7,
+        start_token=args.vocab_size,
+        vocab_size=args.vocab_size,
+        block_size=args.block_size,
+        n_layer=args.n_layer,
+        n_head=args.n_head,
+        n_embd=args.n_embd,
+        attn_pdrop=0.1,
+        embd_pdrop=0.1,
+        beam_size=5,
+        temperature=1.0,
+        device=args.device,
+        full_context_attention=False,
+        direct_skill_tokens=False,
+        skill_token_dim=256,
+    ).to(args.device).eval()
+
+    for full_context_attention in (False, True):
+        model.full_context_attention = full_context_attention
+        context = torch.randn(max(args.batch_sizes), args.context_len, args.n_embd, device=args.device)
+        assert check_parity(model, context, args.vocab_size), \
+            f"cached and uncached decoding differ with full_context_attention={full_context_attention}"
+    model.full_context_attention = False
+    print("cached and uncached decoding sample the same skill tokens")
+
+    print(f"{'batch':>6} {'full (ms)':>12} {'kv cache (ms)':>14} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        context = torch.randn(batch_size, args.context_len, args.n_embd, device=args.device)
+        full = time_decoding(model, context, args.vocab_size, False, args.n_iters, args.n_warmup)
+        cached = time_decoding(model, context, args.vocab_size, True, args.n_iters, args.n_warmup)
+        print(f"{batch_size:>6} {np.median(full):>12.2f} {np.median(cached):>14.2f} "
+              f"{np.median(full) / np.median(cached):>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
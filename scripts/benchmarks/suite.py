@@ -0,0 +1,182 @@
+"""
+Offline throughput benchmark suite running on synthetic data (see
+scripts/generate_synthetic_dataset.py), so that it only needs a cpu. It measures:
+    - dataset: SequenceDataset samples/sec (and build time) for every hdf5_cache_mode
+    - dataloader: DataLoader samples/sec for every number of workers
+    - policy: training steps/sec of every policy config in config/algo, per training stage
+
+Results are written as a flat json dict of "<section>/<setting>/<metric>" values next to the
+environment they were measured in, so that runs on different commits can be diffed, or compared
+with --baseline:
+
+    python scripts/benchmarks/suite.py --output before.json
+    git checkout other-branch
+    python scripts/benchmarks/suite.py --output after.json --baseline before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import torch
+import yaml
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+import quest.utils.columnar_utils as ColumnarUtils
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+def get_policy_algos():
+    # every algo config that defines a policy, e.g. not data_collect.yaml
+    algos = []
+    for file_name in sorted(os.listdir(os.path.join(BenchmarkUtils.CONFIG_DIR, "algo"))):
+        if not file_name.endswith(".yaml"):
+            continue
+        with open(os.path.join(BenchmarkUtils.CONFIG_DIR, "algo", file_name)) as f:
+            if "policy" in (yaml.safe_load(f) or {}):
+                algos.append(file_name[:-len(".yaml")])
+    return algos
+
+
+def get_metadata(args):
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL, text=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "args": vars(args),
+    }
+
+
+def bench_dataset(args, cfg, hdf5_paths, results):
+    for cache_mode in args.cache_modes:
+        if cache_mode == "mmap":
+            # the one-off conversion is not part of the build time
+            for path in hdf5_paths:
+                if not ColumnarUtils.is_columnar_up_to_date(path):
+                    ColumnarUtils.convert_hdf5_to_columnar(path)
+        t0 = time.perf_counter()
+        dataset = BenchmarkUtils.make_synthetic_dataset(
+            cfg, hdf5_paths, load_obs=True, hdf5_cache_mode=None if cache_mode == "none" else cache_mode)
+        build_time = time.perf_counter() - t0
+        samples_per_sec = BenchmarkUtils.time_dataset(dataset, batch_size=args.batch_size, n_batches=args.n_batches)
+        results[f"dataset/{cache_mode}/build_sec"] = build_time
+        results[f"dataset/{cache_mode}/samples_per_sec"] = samples_per_sec
+        print(f"dataset {cache_mode:>8}: {samples_per_sec:10.1f} samples/s, built in {build_time:.2f}s")
+
+
+def bench_dataloader(args, cfg, hdf5_paths, results):
+    dataset = BenchmarkUtils.make_synthetic_dataset(cfg, hdf5_paths, load_obs=True, hdf5_cache_mode=args.dataloader_cache_mode)
+    for num_workers in args.num_workers:
+        kwargs = {"multiprocessing_context": "fork"} if num_workers > 0 else {}
+        samples_per_sec = BenchmarkUtils.time_dataloader(
+            dataset, batch_size=args.batch_size, num_workers=num_workers, n_batches=args.n_batches, **kwargs)
+        results[f"dataloader/workers_{num_workers}/samples_per_sec"] = samples_per_sec
+        print(f"dataloader {num_workers:>2} workers: {samples_per_sec:10.1f} samples/s")
+
+
+def bench_policies(args, hdf5_paths, results):
+    for algo in args.algos:
+        config_names = ["train_prior"]
+        if "autoencoder" in BenchmarkUtils.compose_config("train_prior", [f"algo={algo}"]).algo.policy:
+            config_names.insert(0, "train_autoencoder")
+        for config_name in config_names:
+            model, cfg = BenchmarkUtils.load_policy(
+                algo, args.task, args.device, get_task_overrides(args), config_name=config_name)
+            dataset = BenchmarkUtils.make_synthetic_dataset(cfg, hdf5_paths[0], load_obs=cfg.training.load_obs)
+            batch = BenchmarkUtils.get_synthetic_batch(cfg, dataset, args.policy_batch_size)
+            dataset.close_and_delete_hdf5_handle()
+            times = BenchmarkUtils.time_training_steps(model, batch, n_iters=args.n_iters, n_warmup=args.n_warmup)
+            steps_per_sec = 1000 / np.median(times)
+            results[f"policy/{algo}/stage_{cfg.stage}/steps_per_sec"] = steps_per_sec
+            print(f"policy {algo:>16} stage {cfg.stage}: {steps_per_sec:8.2f} steps/s")
+
+
+def get_task_overrides(args):
+    return [
+        f"task.img_height={args.img_size}",
+        f"task.img_width={args.img_size}",
+        *args.overrides,
+    ]
+
+
+def compare(results, baseline):
+    print(f"\n{'':<50} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key in sorted(set(results) | set(baseline)):
+        old, new = baseline.get(key), results.get(key)
+        if old is None or new is None:
+            old, new = (f"{value:.2f}" if value is not None else "-" for value in (old, new))
+            print(f"{key:<50} {old:>12} {new:>12}")
+            continue
+        print(f"{key:<50} {old:>12.2f} {new:>12.2f} {new / old:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sections', nargs='+', default=['dataset', 'dataloader', 'policy'],
+                        choices=['dataset', 'dataloader', 'policy'])
+    parser.add_argument('--output', default=None, help='json file to write the results to')
+    parser.add_argument('--baseline', default=None, help='json results of an earlier run to compare with')
+    parser.add_argument('--task', default='metaworld_ml45', help='task config providing the shape_meta')
+    parser.add_argument('--data_dir', default=None, help='directory of the synthetic hdf5 files, defaults to a temporary one')
+    parser.add_argument('--n_tasks', type=int, default=4)
+    parser.add_argument('--n_demos', type=int, default=10)
+    parser.add_argument('--demo_length', type=int, nargs=2, default=[100, 200])
+    parser.add_argument('--img_size', type=int, default=128)
+    parser.add_argument('--compression', default=None, help='h5py compression filter, e.g. gzip')
+    parser.add_argument('--cache_modes', nargs='+', default=['none', 'low_dim', 'all', 'mmap'])
+    parser.add_argument('--dataloader_cache_mode', default='low_dim')
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--batch_size', type=int, default=128, help='batch size of the data benchmarks')
+    parser.add_argument('--n_batches', type=int, default=20)
+    parser.add_argument('--algos', nargs='+', default=get_policy_algos())
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--policy_batch_size', type=int, default=32)
+    parser.add_argument('--n_iters', type=int, default=5)
+    parser.add_argument('--n_warmup', type=int, default=2)
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides')
+    args = parser.parse_args()
+
+    # data benchmarks use the sequence settings of quest's prior, which loads observations
+    cfg = BenchmarkUtils.compose_config(
+        "train_prior", ["algo=quest", f"task={args.task}", f"device={args.device}", *get_task_overrides(args)])
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    hdf5_paths = [os.path.join(data_dir, f"task_{i:03d}.hdf5") for i in range(args.n_tasks)]
+    if not all(os.path.exists(path) for path in hdf5_paths):
+        BenchmarkUtils.write_synthetic_benchmark(
+            data_dir, OmegaConf.to_container(cfg.task.shape_meta, resolve=True), n_tasks=args.n_tasks,
+            n_demos=args.n_demos, demo_length=tuple(args.demo_length), compression=args.compression)
+
+    results = {}
+    if 'dataset' in args.sections:
+        bench_dataset(args, cfg, hdf5_paths, results)
+    if 'dataloader' in args.sections:
+        bench_dataloader(args, cfg, hdf5_paths, results)
+    if 'policy' in args.sections:
+        bench_policies(args, hdf5_paths, results)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": get_metadata(args), "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Converts hdf5 datasets to the memory-mapped columnar format read by SequenceDataset with
+hdf5_cache_mode=mmap. Datasets are converted automatically on first use, this script allows
+doing it ahead of training, e.g.
+
+    python scripts/convert_to_columnar.py data/metaworld/ML45/train
+"""
+import argparse
+import glob
+import os
+
+import quest.utils.columnar_utils as ColumnarUtils
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='hdf5 files or directories to search for hdf5 files')
+    parser.add_argument('--overwrite', action='store_true', help='convert even if an up to date copy exists')
+    args = parser.parse_args()
+
+    hdf5_paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            hdf5_paths += sorted(glob.glob(os.path.join(path, '**', '*.hdf5'), recursive=True))
+        else:
+            hdf5_paths.append(path)
+
+    for hdf5_path in hdf5_paths:
+        if not args.overwrite and ColumnarUtils.is_columnar_up_to_date(hdf5_path):
+            print(f'{hdf5_path}: up to date')
+            continue
+        columnar_path = ColumnarUtils.convert_hdf5_to_columnar(hdf5_path, overwrite=args.overwrite)
+        print(f'{hdf5_path} -> {columnar_path}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Writes a synthetic benchmark of random demos in the robomimic hdf5 layout, with the observation
+and action shapes of a task config, so that the data pipeline and the policies can be benchmarked
+without the simulators or the real datasets. Files are written in the directory layout of the
+metaworld datasets, i.e. <output>/<suite_name>/<benchmark_name>/<mode>/<task_name>.hdf5, e.g.
+
+    python scripts/generate_synthetic_dataset.py --task metaworld_ml45 --output data_synthetic \
+        --n_tasks 10 --n_demos 20 --demo_length 100 200 --img_height 64 --img_width 64
+"""
+import argparse
+import os
+
+from omegaconf import OmegaConf
+
+import quest.utils.benchmark_utils as BenchmarkUtils
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--task', default='metaworld_ml45', help='task config providing the shape_meta')
+    parser.add_argument('--output', required=True, help='root directory of the synthetic data, used as data_prefix')
+    parser.add_argument('--n_tasks', type=int, default=None, help='defaults to the n_tasks of the task config')
+    parser.add_argument('--n_demos', type=int, default=10, help='demos per task')
+    parser.add_argument('--demo_length', type=int, nargs='+', default=[100],
+                        help='length of every demo, or min and max of uniformly sampled lengths')
+    parser.add_argument('--img_height', type=int, default=None)
+    parser.add_argument('--img_width', type=int, default=None)
+    parser.add_argument('--task_names', nargs='*', default=None, help='file names of the tasks, defaults to task_000, ...')
+    parser.add_argument('--compression', default=None, help='h5py compression filter, e.g. gzip')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--overrides', nargs='*', default=[], help='extra hydra overrides of the task config')
+    args = parser.parse_args()
+
+    overrides = [f'task={args.task}', *args.overrides]
+    if args.img_height is not None:
+        overrides.append(f'task.img_height={args.img_height}')
+    if args.img_width is not None:
+        overrides.append(f'task.img_width={args.img_width}')
+    cfg = BenchmarkUtils.compose_config('train_prior', overrides)
+    shape_meta = OmegaConf.to_container(cfg.task.shape_meta, resolve=True)
+
+    n_tasks = args.n_tasks
+    if n_tasks is None:
+        n_tasks = len(args.task_names) if args.task_names else cfg.task.n_tasks
+    assert len(args.demo_length) in (1, 2), '--demo_length takes a length or min and max lengths'
+    demo_length = args.demo_length[0] if len(args.demo_length) == 1 else tuple(args.demo_length)
+
+    root = os.path.join(args.output, cfg.task.suite_name, cfg.task.benchmark_name, cfg.task.mode)
+    paths = BenchmarkUtils.write_synthetic_benchmark(
+        root,
+        shape_meta,
+        n_tasks=n_tasks,
+        n_demos=args.n_demos,
+        demo_length=demo_length,
+        seed=args.seed,
+        task_names=args.task_names or None,
+        compression=args.compression,
+    )
+    print(f'wrote {len(paths)} tasks with {args.n_demos} demos each to {root}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# This script trains stage 1 of Quest like main.sh, but data-parallel over several processes and nodes
+# Run it on every node with the same MASTER_ADDR (address of the first node) and NNODES, e.g.
+#   MASTER_ADDR=node0 NNODES=2 bash scripts/quest/main_distributed.sh
+
+NNODES=${NNODES:-1}
+NPROC_PER_NODE=${NPROC_PER_NODE:-4}
+MASTER_ADDR=${MASTER_ADDR:-localhost}
+MASTER_PORT=${MASTER_PORT:-29500}
+
+torchrun \
+    --nnodes=$NNODES \
+    --nproc_per_node=$NPROC_PER_NODE \
+    --rdzv_backend=c10d \
+    --rdzv_endpoint=$MASTER_ADDR:$MASTER_PORT \
+    train.py --config-name=train_prior.yaml \
+    task=libero_90 \
+    algo=quest \
+    exp_name=final \
+    variant_name=block_32_ds_4 \
+    training.use_tqdm=false \
+    training.save_all_checkpoints=true \
+    training.use_amp=false \
+    training.checkpoint_interval_steps=1000 \
+    train_dataloader.persistent_workers=true \
+    train_dataloader.num_workers=6 \
+    train_dataloader.batch_size=32 \
+    make_unique_experiment_dir=false \
+    algo.skill_block_size=32 \
+    algo.downsample_factor=4 \
+    training.auto_continue=true \
+    rollout.num_parallel_envs=5 \
+    rollout.rollouts_per_env=5 \
+    distributed.backend=gloo \
+    seed=0
+
+# Note1: train_dataloader.batch_size is per process, the effective batch size is batch_size * NNODES * NPROC_PER_NODE.
+#        The learning rate is not scaled automatically.
+# Note2: only rank 0 reads checkpoints, logs to wandb, saves checkpoints and runs rollouts, the other ranks wait for it
+#        during rollouts (see distributed.timeout_minutes). Each node needs its own copy of the dataset.
+# Note3: to resume an interrupted run, launch it again with training.resume=true training.auto_continue=false.
+#        The number of processes may change.
+# Note4: on gpus, distributed.backend=nccl is faster. Each process uses the gpu of its local rank.
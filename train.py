@@ -11,8 +11,11 @@ import warnings
 import torch
 import torch.nn as nn
 import quest.utils.utils as utils
+import quest.utils.dist_utils as DistUtils
 from pyinstrument import Profiler
 from quest.utils.logger import Logger
+from quest.utils.dataset import ActionChunkDataset, ResumableRandomSampler
+from quest.env_runner.async_runner import AsyncRolloutRunner
 import gc
 
 OmegaConf.register_new_resolver("eval", eval, replace=True)
@@ -20,6 +23,13 @@ OmegaConf.register_new_resolver("eval", eval, replace=True)
 
 @hydra.main(config_path="config", version_base=None)
 def main(cfg):
+    # a no-op unless launched by torchrun with several processes
+    rank, world_size, local_rank = DistUtils.init_distributed(
+        backend=cfg.distributed.backend, timeout_minutes=cfg.distributed.timeout_minutes)
+    is_main = rank == 0
+    if world_size > 1 and utils.get_device_type(cfg.device) == 'cuda':
+        # one gpu per process
+        cfg.device = f'cuda:{local_rank}'
     device = cfg.device
     seed = cfg.seed
     torch.manual_seed(seed)
@@ -30,30 +40,43 @@ def main(cfg):
                         shape_meta=cfg.task.shape_meta)
     model.to(device)
     model.train()
+    if train_cfg.compile:
+        model.compile_hot_paths(mode=train_cfg.compile_mode)
 
     # start training
     optimizers = model.get_optimizers()
     schedulers = model.get_schedulers(optimizers)
 
-    scaler = torch.cuda.amp.GradScaler(enabled=train_cfg.use_amp)
+    scaler = utils.get_grad_scaler(device, enabled=train_cfg.use_amp, amp_dtype=train_cfg.amp_dtype)
 
-    experiment_dir, experiment_name = utils.get_experiment_dir(cfg)
-    os.makedirs(experiment_dir, exist_ok=True)
+    # rank 0 creates the experiment dir, so the other ranks can't look for a free one themselves
+    experiment_dir, experiment_name = DistUtils.broadcast_object(
+        utils.get_experiment_dir(cfg) if is_main else None)
+    if is_main:
+        os.makedirs(experiment_dir, exist_ok=True)
 
     start_epoch, steps, wandb_id = 0, 0, None
-    if train_cfg.auto_continue:
+    sampler_state, rng_states = None, None
+    if not is_main:
+        # the checkpoint is read by rank 0 and broadcast, so nodes don't need a shared file system
+        checkpoint_path = None
+    elif train_cfg.auto_continue:
         checkpoint_path = experiment_dir.rsplit('/', 1)[0] + f'/stage_{cfg.stage - 1}'
         if 'libero' in checkpoint_path and cfg.stage == 2:
             checkpoint_path = checkpoint_path.replace('10', '90') # since we want to initialize the model from the libero_90 benchmark
-    elif train_cfg.resume and len(os.listdir(experiment_dir)) > 0: 
-        checkpoint_path = experiment_dir
-    else: 
-        checkpoint_path = cfg.checkpoint_path
-    
-    if checkpoint_path is not None:
         checkpoint_path = utils.get_latest_checkpoint(checkpoint_path)
+    elif train_cfg.resume and utils.get_resume_checkpoint(experiment_dir) is not None:
+        # resume from the most recent checkpoint, which can be a step checkpoint
+        checkpoint_path = utils.get_resume_checkpoint(experiment_dir)
+    elif cfg.checkpoint_path is not None:
+        checkpoint_path = utils.get_latest_checkpoint(cfg.checkpoint_path)
+    else:
+        checkpoint_path = None
+    
+    state_dict = utils.load_state(checkpoint_path) if checkpoint_path is not None else None
+    state_dict = DistUtils.broadcast_object(state_dict)
+    if state_dict is not None:
         print(f'loading from checkpoint {checkpoint_path}')
-        state_dict = utils.load_state(checkpoint_path)
         loaded_state_dict = state_dict['model']
         
         # Below line allows loading state dicts with some mismatched parameters
@@ -70,17 +93,61 @@ def main(cfg):
             start_epoch = state_dict['epoch']
             steps = state_dict['steps']
             wandb_id = state_dict['wandb_id']
+            # older checkpoints don't have these, and only step checkpoints have a sampler state
+            sampler_state = state_dict.get('sampler')
+            rng_states = state_dict.get('rng_states')
+            if isinstance(rng_states, list):
+                # distributed runs save the rng states of every rank
+                rng_states = rng_states[rank] if len(rng_states) == world_size else None
+            elif world_size > 1:
+                rng_states = None
+        del state_dict
     else:
         print('starting from scratch')
 
+    # every rank starts from the weights of rank 0, but draws its own augmentations
+    DistUtils.broadcast_parameters(model)
+    if world_size > 1:
+        torch.manual_seed(seed + rank)
+
     dataset = instantiate(cfg.task.dataset)
-    model.preprocess_dataset(dataset, use_tqdm=train_cfg.use_tqdm)
-    train_dataloader = instantiate(
-        cfg.train_dataloader, 
-        dataset=dataset)
+    # rank 0 goes first, so that the other ranks can reuse the caches it writes
+    if not is_main:
+        DistUtils.barrier()
+    model.preprocess_dataset(dataset, use_tqdm=train_cfg.use_tqdm and is_main)
+    if is_main:
+        DistUtils.barrier()
+    # the sampler decides the order of every epoch so that it can be restored mid-epoch, and
+    # splits it between ranks
+    sampler = ResumableRandomSampler(
+        dataset, shuffle=cfg.train_dataloader.shuffle, seed=seed, num_replicas=world_size, rank=rank)
+    batch_size = cfg.train_dataloader.batch_size
+    if train_cfg.action_chunk_dataset:
+        # the autoencoder only needs action windows, which are sampled on the training device
+        assert cfg.stage == 0 and not train_cfg.load_obs, \
+            "action_chunk_dataset can only be used for autoencoder training without observations"
+        train_dataloader = ActionChunkDataset(
+            dataset,
+            batch_size=batch_size,
+            device=device,
+            sampler=sampler)
+    else:
+        train_dataloader = instantiate(
+            cfg.train_dataloader, 
+            dataset=dataset,
+            sampler=sampler,
+            shuffle=False)
+    drop_last = train_dataloader.drop_last
+    if train_cfg.prefetch_to_device:
+        train_dataloader = utils.DevicePrefetcher(train_dataloader, device)
 
 
-    if cfg.rollout.enabled:
+    # only rank 0 runs rollouts
+    rollout_enabled = cfg.rollout.enabled and is_main
+    if rollout_enabled and cfg.rollout.asynchronous:
+        # rollouts run in worker processes with their own copy of the policy while training continues
+        env_runner = AsyncRolloutRunner(cfg, num_workers=cfg.rollout.num_workers, device=cfg.rollout.device)
+    elif rollout_enabled:
         env_runner = instantiate(cfg.task.env_runner)
         # rollout_results = env_runner.run(model, n_video=cfg.rollout.n_video, do_tqdm=train_cfg.use_tqdm) # for debugging env runner before starting training
     
@@ -92,55 +159,140 @@ def main(cfg):
         name=experiment_name,
         config=OmegaConf.to_container(cfg, resolve=True),
         id=wandb_id,
-        **cfg.logging
+        **{**cfg.logging, 'mode': cfg.logging.mode if is_main else 'disabled'}
     )
 
-    logger = Logger(train_cfg.log_interval)
+    logger = Logger(
+        train_cfg.log_interval,
+        jsonl_path=os.path.join(experiment_dir, 'metrics.jsonl') if train_cfg.log_jsonl and is_main else None)
+    timer = utils.StepTimer(device, synchronize=train_cfg.sync_step_timing, enabled=train_cfg.step_timing)
+    if rollout_enabled and cfg.rollout.asynchronous:
+        # asynchronous rollout results are plotted against the step of the evaluated weights
+        wandb.define_metric("rollout_step")
+        for prefix in ("rollout", "rollout_success_rate", "rollout_videos"):
+            wandb.define_metric(f"{prefix}/*", step_metric="rollout_step")
+
+    def log_rollout(rollout_results, rollout_step):
+        print(
+            f"[info]     success rate: {rollout_results['rollout']['overall_success_rate']:1.3f} \
+                | environments solved: {rollout_results['rollout']['environments_solved']}")
+        if cfg.rollout.asynchronous:
+            logger.log_delayed(rollout_results, rollout_step, current_step=steps, step_metric="rollout_step")
+        else:
+            logger.log(rollout_results, step=steps)
+    checkpoint_writer = utils.CheckpointWriter(
+        keep_last=train_cfg.keep_last_checkpoints,
+        asynchronous=train_cfg.async_checkpointing)
+
+    def get_training_state(epoch, sampler_state=None):
+        return {
+            'model': model,
+            'optimizers': optimizers,
+            'schedulers': schedulers,
+            'scaler': scaler,
+            'epoch': epoch,
+            'stage': cfg.stage,
+            'steps': steps,
+            'wandb_id': wandb.run.id,
+            'experiment_dir': experiment_dir,
+            'experiment_name': experiment_name,
+            'config': OmegaConf.to_container(cfg, resolve=True),
+            'sampler': sampler_state,
+            'rng_states': DistUtils.all_gather_object(utils.get_rng_states()) if world_size > 1 else utils.get_rng_states(),
+        }
+
+    def save_checkpoint(path, epoch, sampler_state=None):
+        # every rank takes part in gathering the rng states, but only rank 0 writes
+        training_state = get_training_state(epoch, sampler_state)
+        if is_main:
+            checkpoint_writer.save(training_state, path)
 
     print('Training...')
 
     for epoch in range(start_epoch, train_cfg.n_epochs + 1):
         t0 = time.time()
+        if sampler_state is not None and sampler_state['epoch'] == epoch:
+            # skip the part of the epoch that was consumed before the checkpoint
+            sampler.load_state_dict(sampler_state)
+            print(f'resuming epoch {epoch} after {sampler.start_index} samples')
+        else:
+            sampler.set_epoch(epoch)
         model.train()
         training_loss = 0.0
+        epoch_end_sampler_state = None
         if train_cfg.do_profile:
             profiler = Profiler()
             profiler.start()
-        for idx, data in enumerate(tqdm(train_dataloader, disable=not train_cfg.use_tqdm)):
-            data = utils.map_tensor_to_device(data, device)
+        # time between epochs, e.g. spent on rollouts, is not charged to the first step
+        timer.reset()
+        for idx, data in enumerate(tqdm(train_dataloader, disable=not train_cfg.use_tqdm or not is_main)):
+            timer.lap('data_wait')
+            if rng_states is not None:
+                # restored only now because starting the epoch's dataloader iterator draws a seed
+                utils.set_rng_states(rng_states)
+                rng_states = None
+            if not train_cfg.prefetch_to_device:
+                data = utils.map_tensor_to_device(data, device)
+                timer.lap('host_to_device')
             
             for optimizer in optimizers:
                 optimizer.zero_grad()
 
             with torch.autograd.set_detect_anomaly(False):
-                with torch.autocast(device_type='cuda', dtype=torch.float16, enabled=train_cfg.use_amp):
+                with utils.autocast(device, enabled=train_cfg.use_amp, amp_dtype=train_cfg.amp_dtype):
                     loss, info = model.compute_loss(data)
+                timer.lap('forward')
             
                 scaler.scale(loss).backward()
+                timer.lap('backward')
             
+            # average the gradients of all ranks
+            DistUtils.all_reduce_gradients(model, bucket_size_mb=cfg.distributed.bucket_size_mb)
+            if world_size > 1:
+                timer.lap('grad_all_reduce')
+
             for optimizer in optimizers:
                 scaler.unscale_(optimizer)
             if train_cfg.grad_clip is not None:
                 grad_norm = nn.utils.clip_grad_norm_(
                     model.parameters(), train_cfg.grad_clip
                 )
+            timer.lap('grad_clip')
 
             for optimizer in optimizers:
                 scaler.step(optimizer)
             
             scaler.update()
+            timer.lap('optimizer')
 
             info.update({
                 'epoch': epoch
             })
             if train_cfg.grad_clip is not None:
                 info.update({
-                    "grad_norm": grad_norm.item(),
+                    "grad_norm": grad_norm,
                 })  
             info = {cfg.logging_folder: info}
-            training_loss += loss.item()
+            training_loss += loss.detach()
             steps += 1
+            timer.end_step(num_samples=len(data['actions']) * world_size)
+            if train_cfg.step_timing and steps % train_cfg.log_interval == 0:
+                # already averaged over the log interval
+                info['timing'] = timer.summary()
             logger.update(info, steps)
+            timer.lap('logging')
+
+            if train_cfg.checkpoint_interval_steps and steps % train_cfg.checkpoint_interval_steps == 0:
+                step_sampler_state = sampler.state_dict(
+                    num_consumed=(idx + 1) * batch_size, batch_size=batch_size, drop_last=drop_last)
+                if step_sampler_state['epoch'] == epoch:
+                    save_checkpoint(
+                        os.path.join(experiment_dir, "checkpoint_latest_step.pth"), epoch, step_sampler_state)
+                else:
+                    # no batches are left, the run is resumed from the start of the next epoch, so the
+                    # checkpoint is written once the schedulers stepped at the end of this one
+                    epoch_end_sampler_state = step_sampler_state
+                timer.lap('checkpoint')
 
             if train_cfg.cut and idx > train_cfg.cut:
                 break
@@ -149,11 +301,13 @@ def main(cfg):
             profiler.stop()
             profiler.print()
 
-        training_loss /= len(train_dataloader)
+        training_loss = float(DistUtils.all_reduce_mean(torch.as_tensor(training_loss, device=device))) / max(len(train_dataloader), 1)
         t1 = time.time()
         print(
             f"[info] Epoch: {epoch:3d} | train loss: {training_loss:5.5f} | time: {(t1-t0)/60:4.2f}"
         )
+        if train_cfg.prefetch_to_device:
+            print(f"[info]     waited {train_dataloader.wait_time:.2f}s for data")
 
         if epoch % train_cfg.save_interval == 0 and epoch > 0:
             if cfg.training.save_all_checkpoints:
@@ -164,29 +318,29 @@ def main(cfg):
                 model_checkpoint_name_ep = os.path.join(
                         experiment_dir, f"multitask_model.pth"
                     )
-            utils.save_state({
-                'model': model,
-                'optimizers': optimizers,
-                'schedulers': schedulers,
-                'scaler': scaler,
-                'epoch': epoch,
-                'stage': cfg.stage,
-                'steps': steps,
-                'wandb_id': wandb.run.id,
-                'experiment_dir': experiment_dir,
-                'experiment_name': experiment_name,
-                'config': OmegaConf.to_container(cfg, resolve=True)
-            }, model_checkpoint_name_ep)
-
-        if cfg.rollout.enabled and epoch > 0 and epoch % cfg.rollout.interval == 0:
+            save_checkpoint(model_checkpoint_name_ep, epoch)
+
+        if rollout_enabled and cfg.rollout.asynchronous:
+            for rollout_step, rollout_epoch, rollout_results in env_runner.poll():
+                print(f"[info] rollouts of epoch {rollout_epoch} (step {rollout_step}):")
+                log_rollout(rollout_results, rollout_step)
+            if epoch > 0 and epoch % cfg.rollout.interval == 0:
+                env_runner.submit(model, steps, epoch)
+        elif rollout_enabled and epoch > 0 and epoch % cfg.rollout.interval == 0:
             rollout_results = env_runner.run(model, n_video=cfg.rollout.n_video, do_tqdm=train_cfg.use_tqdm)
-            print(
-                f"[info]     success rate: {rollout_results['rollout']['overall_success_rate']:1.3f} \
-                    | environments solved: {rollout_results['rollout']['environments_solved']}")
-            logger.log(rollout_results, step=steps)
+            log_rollout(rollout_results, steps)
         [scheduler.step() for scheduler in schedulers]
+        if epoch_end_sampler_state is not None:
+            save_checkpoint(
+                os.path.join(experiment_dir, "checkpoint_latest_step.pth"), epoch + 1, epoch_end_sampler_state)
+    checkpoint_writer.close()
+    if rollout_enabled and cfg.rollout.asynchronous:
+        for rollout_step, rollout_epoch, rollout_results in env_runner.close():
+            print(f"[info] rollouts of epoch {rollout_epoch} (step {rollout_step}):")
+            log_rollout(rollout_results, rollout_step)
     print("[info] finished learning\n")
     wandb.finish()
+    DistUtils.cleanup()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file